@@ -3,34 +3,36 @@ import yaml
 import datetime
 import threading
 import time
-import io
 import base64
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+import json
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from werkzeug.security import check_password_hash
 from sqlalchemy import text
-from PIL import Image
 import webbrowser
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
-from db import engine, get_session
-from crawler import fetch_and_save
-from models import WebPage, WebImage
-from urllib.parse import urlparse, urlunparse
-import imagehash
+from db import engine, upgrade_schema
+from queries import (search_pages_by_text, match_image_hashes, get_images_with_pages,
+                     get_thumbs, get_latest_page, get_page_images)
+from evidence import prove_capture, trusted_public_key
+from search_cache import get_search_cache, text_key, image_key
+from batch_search import batch_settings, read_uploads, hash_images, HashIndex
+from watchlist import list_terms, add_terms, delete_term, list_alerts, count_unread, ack_alerts
+import crawl_worker
+from config import CONFIG_PATH, load_config
+# 爬虫、PIL、imagehash、APScheduler 等较重的依赖在首次使用时才导入
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", os.urandom(24).hex())
-CONFIG_PATH = "config.yaml"
 
+# 请求体上限：最大的上传是批量以图搜图，按其总大小限制（修改后需重启）
+app.config['MAX_CONTENT_LENGTH'] = batch_settings(load_config())['max_total_bytes']
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
 
-scheduler = None
-scheduler_lock = threading.Lock()
+# 调度器由 leader 进程持有，见 leader.py；在 start_leader_election() 中创建
+scheduler_leader = None
 
 
 class User(UserMixin):
@@ -45,56 +47,120 @@ def load_user(user_id):
         return User(row[0], row[1]) if row else None
 
 
+def use_worker(config: dict) -> bool:
+    # crawler_mode: worker 时抓取交给独立的 crawl_worker 进程
+    return config.get('crawler_mode', 'inline') == 'worker'
+
 def scheduled_crawl_job():
 
     try:
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f) or {}
+        config = load_config(strict=True)
         
         seeds = config.get('seeds', [])
         print(f"[SCHEDULER] 开始执行定时任务，种子URL数量: {len(seeds)}")
+        if scheduler_leader is not None:
+            scheduler_leader.record_run()
         
-        for url in seeds:
-            try:
-                fetch_and_save(url, depth=0)
-                print(f"[SCHEDULER] 成功抓取: {url}")
-            except Exception as e:
-                print(f"[SCHEDULER] 抓取失败 {url}: {e}")
+        if use_worker(config):
+            result = crawl_worker.submit(seeds, force=True, wait=True, config=config)
+            if not result.get('ok'):
+                print(f"[SCHEDULER] 抓取进程任务失败: {result.get('msg')}")
+            else:
+                print("[SCHEDULER] 抓取进程已完成本轮任务")
+        else:
+            from crawler import fetch_and_save, CrawlRun
+            visited_urls = set()  # 本轮所有种子共享，避免重复抓取
+            with CrawlRun(config) as run:  # 本轮共用连接池和重试队列
+                for url in seeds:
+                    try:
+                        fetch_and_save(url, depth=0, visited_urls=visited_urls, force=True, run=run)
+                        print(f"[SCHEDULER] 成功抓取: {url}")
+                    except Exception as e:
+                        print(f"[SCHEDULER] 抓取失败 {url}: {e}")
         
         build_index()
         print("[SCHEDULER] 索引重建完成")
     except Exception as e:
         print(f"[SCHEDULER] 任务执行失败: {e}")
 
-def init_scheduler():
-    global scheduler
-    with scheduler_lock:
-        if scheduler is None or not scheduler.running:
-            scheduler = BackgroundScheduler()
-            return True
-    return False
-
-def normalize_url(url: str) -> str:
-    try:
-        parsed = urlparse(url)
-        # 统小写协议
-        scheme = parsed.scheme.lower()
-
-        netloc = parsed.netloc
-        if (scheme == 'http' and netloc.endswith(':80')) or \
-           (scheme == 'https' and netloc.endswith(':443')):
-            netloc = netloc.rsplit(':', 1)[0]
-        
-
-        path = parsed.path
-        if not path:
-            path = '/'
+def build_trigger():
+    # 按最新配置构造 APScheduler trigger
+    from apscheduler.triggers.interval import IntervalTrigger
+    from apscheduler.triggers.cron import CronTrigger
+    
+    config = load_config(strict=True)
+    
+    schedule_cfg = config.get('schedule', {})
+    job_type = schedule_cfg.get('type', 'interval')
+    
+    if job_type == 'interval':
+        minutes = schedule_cfg.get('minutes', 60)
+        return IntervalTrigger(minutes=minutes)
+    cron = schedule_cfg
+    return CronTrigger(
+        minute=cron.get('minute', '*'),
+        hour=cron.get('hour', '*'),
+        day=cron.get('day', '*'),
+        month=cron.get('month', '*'),
+        day_of_week=cron.get('week', '*')
+    )
+
+def start_leader_election():
+    # 每个进程调用一次；多进程部署时只有一个进程真正运行调度器
+    global scheduler_leader
+    if scheduler_leader is None:
+        from leader import SchedulerLeader
+        scheduler_leader = SchedulerLeader(scheduled_crawl_job, build_trigger)
+        scheduler_leader.start()
+    return scheduler_leader
+
+def format_timestamp(ts) -> str:
+    return ts.strftime('%Y-%m-%d %H:%M:%S') if isinstance(ts, datetime.datetime) else str(ts)
+
+def parse_time_range():
+    # 可选的 start/end（YYYY-MM-DD，含当天），用于分片裁剪
+    def parse(name):
+        value = request.form.get(name, '').strip()
+        return datetime.datetime.strptime(value, '%Y-%m-%d') if value else None
+    start, end = parse('start'), parse('end')
+    if end is not None:
+        end += datetime.timedelta(days=1)
+    return start, end
+
+def build_image_results(distances: dict) -> list:
+    # distances 为 {图片id: 汉明距离}，取回页面信息、去重排序，只为最终结果读取缩略图
+    results = []
+    seen_page_images = set()  # 用于去重同一页面内完全相同的图片
+    for row in sorted(get_images_with_pages(distances), key=lambda r: r["image_id"]):
+        # 生成唯一标识：页面URL + 图片URL + 时间戳
+        # 这样可以保留同一页面的不同时间版本，但避免重复数据
+        unique_key = f"{row['url']}|{row['image_url']}|{row['timestamp']}"
+        if unique_key in seen_page_images:
+            continue
+        seen_page_images.add(unique_key)
         
-        # 规范化后的URL
-        normalized = urlunparse((scheme, netloc, path, '', '', ''))
-        return normalized
-    except:
-        return url
+        results.append({
+            "image_id": row["image_id"],
+            "url": row["url"],
+            "image_url": row["image_url"],
+            "phash": row["phash"],
+            "order_index": row["order_index"],
+            "hamming": distances[row["image_id"]],
+            "ip": row["ip"],
+            "timestamp": format_timestamp(row["timestamp"]),
+            "sha256": row["sha256"],
+        })
+    
+    # 按汉明距离排序，然后按时间排序
+    results = sorted(results, key=lambda x: (x["hamming"], x["timestamp"]), reverse=True)[:100]
+    
+    # 添加缩略图数据（只读取最终返回的结果）
+    thumbs = get_thumbs(r["image_id"] for r in results)
+    for result in results:
+        thumb = thumbs.get(result.pop("image_id"))
+        if thumb:
+            result["img_b64"] = base64.b64encode(thumb).decode()
+    return results
 
 #路由
 @app.route('/login', methods=['GET', 'POST'])
@@ -127,84 +193,132 @@ def api_search_text():
     kw = request.form.get('keyword', '').strip()
     if not kw: 
         return jsonify({'ok': False, 'msg': '关键字为空'})
+    try:
+        start, end = parse_time_range()
+    except ValueError:
+        return jsonify({'ok': False, 'msg': '日期格式应为 YYYY-MM-DD'})
+    
+    cache = get_search_cache()
+    cache_key = text_key(kw, start, end)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return jsonify({'ok': True, 'data': cached})
+    generation = cache.generation()
     
     # 查询数据库 - 返回所有版本，包括同一网页的不同时间版本
-    with get_session() as s:
-        pages = s.query(WebPage).filter(
-            WebPage.text.contains(kw)
-        ).order_by(WebPage.timestamp.desc()).limit(100).all()
-        
-        #返回所有匹配的网页版本
-        results = []
-        for page in pages:
-            results.append({
-                "url": page.url,
-                "ip": page.ip,
-                "timestamp": page.timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(page.timestamp, datetime.datetime) else str(page.timestamp),
-                "sha256": page.sha256,
-            })
+    pages = search_pages_by_text(kw, limit=100, start=start, end=end)
+    
+    #返回所有匹配的网页版本
+    results = []
+    for page in pages:
+        results.append({
+            "url": page["url"],
+            "ip": page["ip"],
+            "timestamp": format_timestamp(page["timestamp"]),
+            "sha256": page["sha256"],
+        })
     
+    cache.put(cache_key, results, generation)
     return jsonify({'ok': True, 'data': results})
 
 @app.route('/api/search_img', methods=['POST'])
 @login_required
 def api_search_img():
     try:
-        img = Image.open(io.BytesIO(request.files['img'].read()))
-        target_hash = imagehash.phash(img)
+        import imagehash
+        from image_decode import reduced_phash
+        target_hash = reduced_phash(request.files['img'].read())  # 与入库时相同的低分辨率解码路径
         threshold = 5
+        start, end = parse_time_range()
         
-        # 查询数据库 - 返回所有匹配的图片，包括同一网页的不同版本
-        results = []
-        seen_page_images = set()  # 用于去重同一页面内完全相同的图片
+        cache = get_search_cache()
+        cache_key = image_key(str(target_hash), threshold, start, end)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return jsonify({'ok': True, 'data': cached})
+        generation = cache.generation()
+        
+        # 第一遍：各分片并行扫描 (id, phash)，计算汉明距离
+        def match(phash):
+            try:
+                distance = int(target_hash - imagehash.hex_to_flathash(phash, hashsize=8))
+            except Exception:
+                return None
+            return distance if distance <= threshold else None
         
-        with get_session() as s:
-            images = s.query(WebImage).filter(
-                WebImage.phash.is_not(None),
-                WebImage.phash != ""
-            ).yield_per(500)
-            
-            for img_db in images:
-                try:
-                    h_db = imagehash.hex_to_flathash(img_db.phash, hashsize=8)
-                    distance = target_hash - h_db
-                    
-                    if distance <= threshold:
-                        page = img_db.page
-                        
-                        # 生成唯一标识：页面URL + 图片URL + 时间戳
-                        # 这样可以保留同一页面的不同时间版本，但避免重复数据
-                        unique_key = f"{page.url}|{img_db.image_url}|{page.timestamp}"
-                        if unique_key in seen_page_images:
-                            continue
-                        seen_page_images.add(unique_key)
-                        
-                        result = {
-                            "url": page.url,
-                            "image_url": img_db.image_url,
-                            "phash": img_db.phash,
-                            "order_index": img_db.order_index,
-                            "hamming": distance,
-                            "ip": page.ip,
-                            "timestamp": page.timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(page.timestamp, datetime.datetime) else str(page.timestamp),
-                            "sha256": page.sha256,
-                        }
-                        
-                        # 添加缩略图数据
-                        if img_db.thumb_data:
-                            result["img_b64"] = base64.b64encode(img_db.thumb_data).decode()
-                        
-                        results.append(result)
-                except Exception as e:
-                    continue
-            
-            # 按汉明距离排序，然后按时间排序
-            results = sorted(results, key=lambda x: (x["hamming"], x["timestamp"]), reverse=True)[:100]
+        distances = match_image_hashes(match, start, end)
         
+        # 第二遍：一次 join 取回命中图片的页面信息
+        results = build_image_results(distances)
+        
+        cache.put(cache_key, results, generation)
         return jsonify({'ok': True, 'data': results})
     except Exception as e:
         return jsonify({'ok': False, 'msg': f'图片处理失败: {str(e)}'})
 
+@app.route('/api/search_img_batch', methods=['POST'])
+@login_required
+def api_search_img_batch():
+    # 多文件或 zip 上传；结果按查询图片分组，以 NDJSON 逐行流式返回
+    try:
+        config = load_config(strict=True)
+        settings = batch_settings(config)
+        items = read_uploads(request.files.getlist('imgs'), settings['max_images'], settings['max_file_bytes'],
+                             settings['max_total_bytes'])
+        if not items:
+            return jsonify({'ok': False, 'msg': '请上传图片或 zip 压缩包'})
+        start, end = parse_time_range()
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': f'读取上传失败: {str(e)}'})
+    threshold = 5
+
+    def line(obj):
+        return json.dumps(obj, ensure_ascii=False) + '\n'
+
+    def generate():
+        hashed = hash_images(items, settings['workers'])
+        yield line({'ok': True, 'total': len(hashed)})
+
+        cache = get_search_cache()
+        generation = cache.generation()
+        pending = {}  # phash -> [查询名称]，相同图片只算一次
+        for name, phash, error in hashed:
+            if phash is None:
+                yield line({'ok': False, 'query': name, 'msg': f'图片处理失败: {error}'})
+                continue
+            cached = cache.get(image_key(phash, threshold, start, end))
+            if cached is not None:
+                yield line({'ok': True, 'query': name, 'phash': phash, 'data': cached})
+            else:
+                pending.setdefault(phash, []).append(name)
+        if not pending:
+            return
+
+        # 只扫描一遍库内哈希，同时匹配所有未命中缓存的查询
+        try:
+            index = HashIndex(pending, threshold)
+            matches = match_image_hashes(index.match, start, end)
+        except Exception as e:
+            yield line({'ok': False, 'msg': f'搜索失败: {str(e)}'})
+            return
+        groups = {phash: {} for phash in pending}
+        for image_id, found in matches.items():
+            for phash, distance in found.items():
+                groups[phash][image_id] = distance
+
+        # 每组结果组装完即返回
+        for phash, names in pending.items():
+            try:
+                results = build_image_results(groups[phash])
+                cache.put(image_key(phash, threshold, start, end), results, generation)
+                for name in names:
+                    yield line({'ok': True, 'query': name, 'phash': phash, 'data': results})
+            except Exception as e:
+                for name in names:
+                    yield line({'ok': False, 'query': name, 'msg': f'搜索失败: {str(e)}'})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/取证', methods=['POST'])
 @login_required
 def api_取证():
@@ -212,34 +326,142 @@ def api_取证():
     if not url.startswith(('http://', 'https://')):
         return jsonify({'ok': False, 'msg': 'URL 必须以 http/https 开头'})
     try:
-        fetch_and_save(url, depth=0)
+        config = load_config(strict=True)
+        if use_worker(config):
+            result = crawl_worker.submit([url], force=True, wait=True, config=config)
+            if not result.get('ok'):
+                return jsonify({'ok': False, 'msg': f"抓取失败: {result.get('msg')}"})
+        else:
+            from crawler import fetch_and_save
+            fetch_and_save(url, depth=0, force=True)
         
         # 查询最新
-        with get_session() as s:
-            page = s.query(WebPage).filter_by(url=url).order_by(WebPage.id.desc()).first()
-            if not page:
-                return jsonify({'ok': False, 'msg': '抓取失败'})
-            
-            images = s.query(WebImage).filter_by(page_id=page.id).order_by(WebImage.order_index).all()
-            
-            images_data = []
-            for img in images:
-                images_data.append({
-                    'image_url': img.image_url,
-                    'img_b64': base64.b64encode(img.thumb_data).decode() if img.thumb_data else '',
-                    'phash': img.phash,
-                })
-            
-            return jsonify({
-                'ok': True,
-                'data': {
-                    'url': page.url,
-                    'ip': page.ip,
-                    'timestamp': page.timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(page.timestamp, datetime.datetime) else str(page.timestamp),
-                    'sha256': page.sha256,
-                    'images': images_data,
-                }
+        page = get_latest_page(url)
+        if not page:
+            return jsonify({'ok': False, 'msg': '抓取失败'})
+        
+        images_data = []
+        for img in get_page_images(page["id"]):
+            images_data.append({
+                'image_url': img["image_url"],
+                'img_b64': base64.b64encode(img["thumb_data"]).decode() if img["thumb_data"] else '',
+                'phash': img["phash"],
             })
+        
+        return jsonify({
+            'ok': True,
+            'data': {
+                'url': page["url"],
+                'ip': page["ip"],
+                'timestamp': format_timestamp(page["timestamp"]),
+                'sha256': page["sha256"],
+                'images': images_data,
+            }
+        })
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)})
+
+@app.route('/api/cache_stats', methods=['GET'])
+@login_required
+def api_cache_stats():
+    try:
+        return jsonify({'ok': True, 'data': get_search_cache().stats()})
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)})
+
+@app.route('/api/proof', methods=['GET'])
+@login_required
+def api_proof():
+    # 单条采集记录的 Merkle 包含证明
+    kind = request.args.get('kind', 'page')
+    if kind not in ('page', 'image'):
+        return jsonify({'ok': False, 'msg': 'kind 必须是 page 或 image'})
+    try:
+        ref_id = int(request.args.get('id', ''))
+    except ValueError:
+        return jsonify({'ok': False, 'msg': 'id 无效'})
+    try:
+        config = load_config(strict=True)
+        result = prove_capture(kind, ref_id, trusted_public_key(config))
+        if result is None:
+            return jsonify({'ok': False, 'msg': '该记录尚未固化'})
+        return jsonify({'ok': True, 'data': result})
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)})
+
+@app.route('/api/watchlist', methods=['GET'])
+@login_required
+def api_watchlist():
+    try:
+        return jsonify({'ok': True, 'data': list_terms()})
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)})
+
+@app.route('/api/watchlist', methods=['POST'])
+@login_required
+def api_watchlist_add():
+    # 关键字每行一个；目标图片可上传文件或直接填写 phash
+    kind = request.form.get('kind', 'keyword')
+    label = request.form.get('label', '').strip()
+    try:
+        if kind == 'image' and 'img' in request.files:
+            from image_decode import reduced_phash
+            values = [str(reduced_phash(request.files['img'].read()))]
+        else:
+            values = request.form.get('value', '').splitlines()
+        added = add_terms(kind, values, label)
+        return jsonify({'ok': True, 'data': {'added': added}})
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': f'添加监控失败: {str(e)}'})
+
+@app.route('/api/watchlist/delete', methods=['POST'])
+@login_required
+def api_watchlist_delete():
+    try:
+        if not delete_term(int(request.form.get('id', ''))):
+            return jsonify({'ok': False, 'msg': '监控条目不存在'})
+        return jsonify({'ok': True})
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)})
+
+@app.route('/api/alerts', methods=['GET'])
+@login_required
+def api_alerts():
+    try:
+        limit = min(int(request.args.get('limit', 100)), 500)
+        alerts = list_alerts(limit, request.args.get('unread') == '1')
+        # 图片告警附带缩略图
+        thumbs = get_thumbs(a.image_id for a in alerts if a.image_id)
+        data = []
+        for a in alerts:
+            item = {
+                "id": a.id,
+                "created_at": format_timestamp(a.created_at),
+                "kind": a.kind,
+                "term": a.term,
+                "label": a.label,
+                "page_id": a.page_id,
+                "url": a.url,
+                "image_url": a.image_url,
+                "hits": a.hits,
+                "distance": a.distance,
+                "snippet": a.snippet,
+                "acknowledged": a.acknowledged,
+            }
+            if thumbs.get(a.image_id):
+                item["img_b64"] = base64.b64encode(thumbs[a.image_id]).decode()
+            data.append(item)
+        return jsonify({'ok': True, 'data': data, 'unread': count_unread()})
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)})
+
+@app.route('/api/alerts/ack', methods=['POST'])
+@login_required
+def api_alerts_ack():
+    # ids 为逗号分隔的告警 id，不传则全部标记已读
+    try:
+        ids = [int(i) for i in request.form.get('ids', '').split(',') if i.strip()]
+        return jsonify({'ok': True, 'data': {'acknowledged': ack_alerts(ids)}})
     except Exception as e:
         return jsonify({'ok': False, 'msg': str(e)})
 
@@ -250,10 +472,29 @@ def init_config_file():
         "data_dir": "./data",
         "hamming_threshold": 5,
         "max_depth": 1,
+        "crawler_mode": "inline",
+        "sharding": {
+            "enabled": True
+        },
         "seeds": [],
         "schedule": {
             "type": "interval",
             "minutes": 60
+        },
+        "recrawl": {
+            "default_minutes": 1440,
+            "bloom_capacity": 1000000,
+            "urls": {}
+        },
+        "batch_search": {
+            "max_images": 500,
+            "max_file_mb": 20,
+            "max_total_mb": 200
+        },
+        "image_decode": {
+            "fast_path": True,
+            "verify": False,
+            "tolerance": 4
         }
     }
     with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
@@ -267,8 +508,7 @@ def get_schedule_config():
         if not os.path.exists(CONFIG_PATH):
             init_config_file()
         
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f) or {}
+        config = load_config(strict=True)
         
         config.setdefault('data_dir', './data')
         config.setdefault('hamming_threshold', 5)
@@ -295,8 +535,7 @@ def save_schedule_config():
         
         existing_config = {}
         if os.path.exists(CONFIG_PATH):
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                existing_config = yaml.safe_load(f) or {}
+            existing_config = load_config(strict=True)
         
         existing_config['data_dir'] = new_config.get('data_dir', './data')
         existing_config['hamming_threshold'] = new_config.get('hamming_threshold', 5)
@@ -316,16 +555,7 @@ def save_schedule_config():
 @login_required
 def get_scheduler_status():
     try:
-        status = {
-            'running': scheduler is not None and scheduler.running,
-            'last_run': None,
-            'next_run': None
-        }
-        
-        if status['running'] and scheduler.get_jobs():
-            job = scheduler.get_jobs()[0]
-            status['next_run'] = job.next_run_time.isoformat() if job.next_run_time else None
-        
+        status = start_leader_election().status()
         return jsonify({'ok': True, 'data': status})
     except Exception as e:
         return jsonify({'ok': False, 'msg': str(e)})
@@ -334,37 +564,9 @@ def get_scheduler_status():
 @login_required
 def start_scheduler():
 
-    global scheduler
     try:
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f) or {}
-        
-        schedule_cfg = config.get('schedule', {})
-        job_type = schedule_cfg.get('type', 'interval')
-        
-        init_scheduler()
-        
-        if scheduler.running:
-            scheduler.remove_all_jobs()
-        
-        if job_type == 'interval':
-            minutes = schedule_cfg.get('minutes', 60)
-            trigger = IntervalTrigger(minutes=minutes)
-        else:
-            cron = schedule_cfg
-            trigger = CronTrigger(
-                minute=cron.get('minute', '*'),
-                hour=cron.get('hour', '*'),
-                day=cron.get('day', '*'),
-                month=cron.get('month', '*'),
-                day_of_week=cron.get('week', '*')
-            )
-        
-        scheduler.add_job(scheduled_crawl_job, trigger, id='crawl_job')
-        
-        if not scheduler.running:
-            scheduler.start()
-        
+        build_trigger()  # 先校验配置，错误直接返回给前端
+        start_leader_election().request(running=True)
         return jsonify({'ok': True, 'msg': '调度器启动成功'})
     except Exception as e:
         return jsonify({'ok': False, 'msg': f'启动失败: {str(e)}'})
@@ -372,13 +574,12 @@ def start_scheduler():
 @app.route('/api/stop_scheduler', methods=['POST'])
 @login_required
 def stop_scheduler():
-    global scheduler
     try:
-        if scheduler is None or not scheduler.running:
+        leader = start_leader_election()
+        if not leader.status()['running']:
             return jsonify({'ok': False, 'msg': '调度器未运行'})
         
-        scheduler.shutdown()
-        scheduler = None
+        leader.request(running=False)
         
         return jsonify({'ok': True, 'msg': '调度器停止成功'})
     except Exception as e:
@@ -390,6 +591,8 @@ def run_flask_app():
 if __name__ == '__main__':
     if not os.path.exists(CONFIG_PATH):
         init_config_file()
+    upgrade_schema()
+    start_leader_election()
     
     flask_thread = threading.Thread(target=run_flask_app, daemon=True)
     flask_thread.start()
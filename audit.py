@@ -0,0 +1,168 @@
+# audit.py
+# 完整性审计：按批次并行重算整个数据库的 Merkle 根并与签名清单核对
+#   python audit.py                 审计全部批次
+#   python audit.py --seal          先固化未入批次的记录再审计
+#   python audit.py --prove page 12 输出单条记录的包含证明
+#   python audit.py --gen-key PATH  生成 Ed25519 签名私钥（放在 data_dir 之外），输出公钥
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select
+from models import WebPage, WebImage, EvidenceBatch, EvidenceLeaf
+from db import engine, get_session, upgrade_schema
+from shards import SHARD_ID_BITS, list_shards, shard_session
+from queries import chunked
+from config import load_config
+from evidence import (page_leaf, image_leaf, sha256_hex, merkle_root, verify_manifest, trusted_public_key,
+                      generate_signing_key, key_fingerprint, manifest_path, seal_pending, prove_capture,
+                      count_unsealed)
+
+def _init_worker():
+    # fork 出来的子进程不能复用父进程的数据库连接
+    engine.dispose(close=False)
+
+def audit_batch(batch_id: int, data_dir: str, trusted_key: str = None) -> dict:
+    problems = []
+    with get_session() as s:
+        batch = s.get(EvidenceBatch, batch_id)
+        manifest = json.loads(batch.manifest)
+
+        signature = verify_manifest(batch.manifest, batch.signature, trusted_key)
+        if signature["error"]:
+            problems.append(signature["error"])
+        if manifest.get("root") != batch.root:
+            problems.append("清单根与批次根不一致")
+
+        # 与库外清单副本比对
+        path = manifest_path(data_dir, batch_id)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("manifest", {}).get("root") != batch.root or stored.get("signature") != batch.signature:
+                problems.append("库外清单副本与数据库不一致")
+        else:
+            problems.append("缺少库外清单副本")
+
+        # 叶子目录在主库，记录本身按 id 定位到各自的分片
+        groups = {}
+        for row in s.execute(
+            select(EvidenceLeaf.leaf_index, EvidenceLeaf.kind, EvidenceLeaf.ref_id, EvidenceLeaf.leaf_hash)
+            .where(EvidenceLeaf.batch_id == batch_id)
+        ):
+            groups.setdefault((row.kind, row.ref_id >> SHARD_ID_BITS), {})[row.ref_id] = (row.leaf_index, row.leaf_hash)
+
+    recomputed = {}
+    expected = {}
+    shards = {sh.index: sh for sh in list_shards(include_offline=True)}
+    for (kind, shard_index), leaves in groups.items():
+        shard = shards.get(shard_index)
+        if shard is None or shard.state == "offline":
+            problems.append(f"分片 {shard_index} 不可用，跳过 {len(leaves)} 条 {kind}")
+            continue
+        for index, leaf_hash in leaves.values():
+            expected[index] = leaf_hash
+        with shard_session(shard) as ss:
+            for chunk in chunked(list(leaves)):
+                if kind == "page":
+                    # 网页：从 html 重新计算哈希，流式读取
+                    rows = ss.execute(
+                        select(WebPage.id, WebPage.url, WebPage.ip, WebPage.timestamp, WebPage.sha256, WebPage.html)
+                        .where(WebPage.id.in_(chunk))
+                        .execution_options(yield_per=200)
+                    )
+                    for row in rows:
+                        html_hash = sha256_hex((row.html or "").encode("utf-8"))
+                        if html_hash != row.sha256:
+                            problems.append(f"page {row.id}: html 与记录的 sha256 不符")
+                        recomputed[leaves[row.id][0]] = page_leaf(row.id, row.url, row.ip, row.timestamp, html_hash)
+                else:
+                    rows = ss.execute(
+                        select(WebImage.id, WebImage.page_id, WebImage.image_url, WebImage.sha256,
+                               WebImage.phash, WebImage.thumb_data)
+                        .where(WebImage.id.in_(chunk))
+                        .execution_options(yield_per=1000)
+                    )
+                    for row in rows:
+                        recomputed[leaves[row.id][0]] = image_leaf(row.id, row.page_id, row.image_url, row.sha256,
+                                                                   row.phash, sha256_hex(row.thumb_data))
+
+    if len(recomputed) != batch.leaf_count:
+        problems.append(f"记录缺失: {batch.leaf_count - len(recomputed)} 条")
+    for index in sorted(recomputed):
+        if recomputed[index].hex() != expected.get(index):
+            problems.append(f"叶子 {index} 内容被修改")
+
+    ok_root = len(recomputed) == batch.leaf_count and \
+        merkle_root([recomputed[i] for i in range(batch.leaf_count)]).hex() == batch.root
+    if not ok_root:
+        problems.append("重算的 Merkle 根与清单不符")
+
+    return {"batch_id": batch_id, "leaf_count": batch.leaf_count, "ok": not problems, "problems": problems}
+
+def run_audit(data_dir: str, workers: int = None, trusted_key: str = None) -> bool:
+    if not trusted_key:
+        print("[AUDIT] 警告: 未配置 evidence.public_key，只能验证签名本身，无法确认签名者")
+    with get_session() as s:
+        batch_ids = s.scalars(select(EvidenceBatch.id).order_by(EvidenceBatch.id)).all()
+    print(f"[AUDIT] 共 {len(batch_ids)} 个批次，开始并行审计...")
+
+    all_ok = True
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for result in pool.map(audit_batch, batch_ids, [data_dir] * len(batch_ids),
+                               [trusted_key] * len(batch_ids)):
+            total += result["leaf_count"]
+            if result["ok"]:
+                print(f"[AUDIT] 批次 {result['batch_id']} 通过 ({result['leaf_count']} 条)")
+            else:
+                all_ok = False
+                print(f"[AUDIT] 批次 {result['batch_id']} 失败:")
+                for problem in result["problems"][:20]:
+                    print(f"    - {problem}")
+
+    unsealed = count_unsealed()
+    print(f"[AUDIT] 已审计 {total} 条记录；未固化: 网页 {unsealed['pages']}，图片 {unsealed['images']}")
+    print("[AUDIT] 结论: " + ("全部通过" if all_ok else "发现异常"))
+    return all_ok
+
+def main():
+    parser = argparse.ArgumentParser(description="取证数据完整性审计")
+    parser.add_argument("--seal", action="store_true", help="先固化未入批次的记录")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认 CPU 核数")
+    parser.add_argument("--prove", nargs=2, metavar=("KIND", "ID"), help="输出单条记录的包含证明 (page/image)")
+    parser.add_argument("--gen-key", metavar="PATH", help="生成 Ed25519 签名私钥并输出公钥")
+    args = parser.parse_args()
+
+    if args.gen_key:
+        public_hex = generate_signing_key(args.gen_key)
+        print(f"私钥已写入 {args.gen_key}，请妥善保管，不要放在 data_dir 内")
+        print(f"公钥: {public_hex}")
+        print(f"指纹: {key_fingerprint(public_hex)}")
+        print("在 config.yaml 中设置 evidence.key_file 和 evidence.public_key（公钥可发布给第三方）")
+        sys.exit(0)
+
+    upgrade_schema()
+    config = load_config()
+    data_dir = config.get("data_dir", "./data")
+    evidence_cfg = config.get("evidence", {}) or {}
+    trusted_key = trusted_public_key(config)
+
+    if args.prove:
+        kind, ref_id = args.prove
+        result = prove_capture(kind, int(ref_id), trusted_key)
+        if result is None:
+            print("该记录尚未固化")
+            sys.exit(1)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        ok = result["signature_ok"] and result["key_trusted"] is not False and result["content_ok"] and result["proof_ok"]
+        sys.exit(0 if ok else 1)
+
+    if args.seal:
+        seal_pending(data_dir, evidence_cfg.get("batch_size", 50000), evidence_cfg.get("key_file"))
+
+    sys.exit(0 if run_audit(data_dir, args.workers, trusted_key) else 1)
+
+if __name__ == '__main__':
+    main()
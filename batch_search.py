@@ -0,0 +1,141 @@
+# batch_search.py
+# 批量以图搜图：一次上传多张图片（多文件或 zip），并行计算 phash，
+# 然后只扫描一遍库内哈希，同时与所有查询图片比较
+import os
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_IMAGES = 500
+DEFAULT_MAX_FILE_MB = 20
+DEFAULT_MAX_TOTAL_MB = 200
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff')
+
+
+def batch_settings(config: dict) -> dict:
+    batch_cfg = config.get("batch_search", {}) or {}
+    return {
+        "max_images": int(batch_cfg.get("max_images", DEFAULT_MAX_IMAGES)),
+        "max_file_bytes": int(batch_cfg.get("max_file_mb", DEFAULT_MAX_FILE_MB)) * 1024 * 1024,
+        "max_total_bytes": int(batch_cfg.get("max_total_mb", DEFAULT_MAX_TOTAL_MB)) * 1024 * 1024,
+        "workers": int(batch_cfg.get("hash_workers", min(8, os.cpu_count() or 1))),
+    }
+
+
+def _seekable(stream, max_bytes: int = None):
+    # Werkzeug 的上传内容在临时文件或 BytesIO 中，可以直接 seek；其他情况先读入内存
+    try:
+        if stream.seekable():
+            stream.seek(0)
+            return stream
+    except (AttributeError, OSError):
+        pass
+    data = stream.read(max_bytes + 1) if max_bytes is not None else stream.read()
+    if max_bytes is not None and len(data) > max_bytes:
+        raise ValueError(f"上传内容超过 {max_bytes // 1024 // 1024} MB")
+    return io.BytesIO(data)
+
+def read_uploads(files, max_images: int, max_file_bytes: int, max_total_bytes: int = None) -> list:
+    # 展开上传内容为 [(名称, 字节)]；zip 内只取图片扩展名的文件，按声明大小和实际读取长度双重限制。
+    # 所有图片都要先读入内存，解压后的总大小也要限制
+    items = []
+    total = 0
+
+    def add(name, content):
+        nonlocal total
+        total += len(content)
+        if max_total_bytes is not None and total > max_total_bytes:
+            raise ValueError(f"上传图片总大小超过 {max_total_bytes // 1024 // 1024} MB")
+        items.append((name, content))
+
+    for storage in files:
+        name = storage.filename or "upload"
+        stream = _seekable(storage.stream, max_total_bytes)
+        if name.lower().endswith(".zip") or zipfile.is_zipfile(stream):
+            # 压缩包本身不受单文件大小限制，直接在上传的临时文件上解压，不整体读入内存
+            stream.seek(0, os.SEEK_END)
+            if max_total_bytes is not None and stream.tell() > max_total_bytes:
+                raise ValueError(f"{name} 超过上传总大小限制 {max_total_bytes // 1024 // 1024} MB")
+            stream.seek(0)
+            with zipfile.ZipFile(stream) as zf:
+                for info in zf.infolist():
+                    inner = info.filename
+                    if info.is_dir() or inner.startswith("__MACOSX/") or not inner.lower().endswith(IMAGE_EXTS):
+                        continue
+                    if info.file_size > max_file_bytes:
+                        raise ValueError(f"{name}/{inner} 超过单文件大小限制")
+                    if max_total_bytes is not None and total + info.file_size > max_total_bytes:
+                        raise ValueError(f"上传图片总大小超过 {max_total_bytes // 1024 // 1024} MB")
+                    with zf.open(info) as f:
+                        content = f.read(max_file_bytes + 1)
+                    if len(content) > max_file_bytes:
+                        raise ValueError(f"{name}/{inner} 超过单文件大小限制")
+                    add(f"{name}/{inner}", content)
+                    if len(items) > max_images:
+                        raise ValueError(f"一次最多搜索 {max_images} 张图片")
+        else:
+            stream.seek(0)
+            data = stream.read(max_file_bytes + 1)
+            if len(data) > max_file_bytes:
+                raise ValueError(f"{name} 超过单文件大小限制")
+            add(name, data)
+        if len(items) > max_images:
+            raise ValueError(f"一次最多搜索 {max_images} 张图片")
+    return items
+
+
+def _phash(data: bytes) -> str:
+    # 与入库时相同的低分辨率解码路径，查询哈希和库中哈希一致
+    from image_decode import reduced_phash
+    return str(reduced_phash(data))
+
+def hash_images(items: list, workers: int) -> list:
+    # 解码和 DCT 大部分时间不持有 GIL，线程池即可并行；返回 [(名称, phash 或 None, 错误信息)]
+    def run(item):
+        name, data = item
+        try:
+            return name, _phash(data), None
+        except Exception as e:
+            return name, None, str(e)
+
+    if workers <= 1 or len(items) <= 1:
+        return [run(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, items))
+
+
+class HashIndex:
+    # 多个查询哈希的汉明距离索引：64 位哈希切成 threshold+1 段，
+    # 距离不超过 threshold 的两个哈希至少有一段完全相同（抽屉原理），
+    # 库内每个哈希只需按段查表，再对少量候选精确计算距离
+
+    def __init__(self, hashes, threshold: int, bits: int = 64):
+        self.threshold = threshold
+        self.values = {h: int(h, 16) for h in hashes}
+        parts = min(threshold + 1, bits)
+        bounds = [bits * i // parts for i in range(parts + 1)]
+        self.segments = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+        self.tables = [{} for _ in self.segments]
+        for h, value in self.values.items():
+            for table, (shift, mask) in zip(self.tables, self.segments):
+                table.setdefault((value >> shift) & mask, []).append(h)
+
+    def match(self, phash: str):
+        # 返回 {查询哈希: 距离}，没有命中返回 None（供 match_image_hashes 使用）
+        try:
+            value = int(phash, 16)
+        except (TypeError, ValueError):
+            return None
+        found = None
+        checked = set()
+        for table, (shift, mask) in zip(self.tables, self.segments):
+            for h in table.get((value >> shift) & mask, ()):
+                if h in checked:
+                    continue
+                checked.add(h)
+                distance = (value ^ self.values[h]).bit_count()
+                if distance <= self.threshold:
+                    if found is None:
+                        found = {}
+                    found[h] = distance
+        return found
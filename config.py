@@ -0,0 +1,16 @@
+# config.py
+# 读取 config.yaml：app、crawler、抓取进程和各命令行工具共用，只依赖 yaml，导入开销小
+import yaml
+
+CONFIG_PATH = "config.yaml"
+
+
+def load_config(strict: bool = False) -> dict:
+    # 读取失败时返回空配置；strict=True 时把异常抛给调用方（如保存配置前读取，不能当作空配置覆盖）
+    try:
+        with open(CONFIG_PATH, encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    except Exception:
+        if strict:
+            raise
+        return {}
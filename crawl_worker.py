@@ -0,0 +1,134 @@
+# crawl_worker.py
+# 独立的抓取工作进程：Web 进程通过本地队列提交抓取任务，自身不需要加载爬虫依赖
+#   python crawl_worker.py
+# 在 config.yaml 中设置 crawler_mode: worker 后，Web 端的抓取请求都会转发到这里
+import os
+import queue
+import threading
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from config import load_config
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5001
+
+def get_address(config: dict):
+    worker_cfg = config.get("worker", {}) or {}
+    return (worker_cfg.get("host", DEFAULT_HOST), int(worker_cfg.get("port", DEFAULT_PORT)))
+
+def get_authkey(config: dict) -> bytes:
+    # 优先使用环境变量，否则在 data_dir 下生成并保存，Web 进程与工作进程共用
+    env_key = os.getenv("CRAWL_WORKER_KEY")
+    if env_key:
+        return env_key.encode("utf-8")
+    data_dir = config.get("data_dir", "./data")
+    os.makedirs(data_dir, exist_ok=True)
+    key_path = os.path.join(data_dir, "worker.key")
+    if not os.path.exists(key_path):
+        try:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(os.urandom(32).hex())
+        except FileExistsError:
+            pass
+    with open(key_path, "r") as f:
+        return f.read().strip().encode("utf-8")
+
+
+class CrawlWorker:
+
+    def __init__(self, config: dict):
+        self.address = get_address(config)
+        self.authkey = get_authkey(config)
+        self.jobs = queue.Queue()
+        self.current = None
+        self.done_count = 0
+
+    def crawl_loop(self):
+        # 任务按提交顺序串行执行；单个任务出错不能结束抓取线程，否则等待中的提交方会一直阻塞
+        while True:
+            urls, force, done, result = self.jobs.get()
+            self.current = urls
+            try:
+                from crawler import fetch_and_save, CrawlRun
+                visited_urls = set()  # 同一任务内的种子共享
+                with CrawlRun(load_config()) as run:  # 同一任务共用连接池和重试队列
+                    for url in urls:
+                        try:
+                            fetch_and_save(url, depth=0, visited_urls=visited_urls, force=force, run=run)
+                            print(f"[WORKER] 成功抓取: {url}")
+                        except Exception as e:
+                            result["failed"].append(url)
+                            print(f"[WORKER] 抓取失败 {url}: {e}")
+            except Exception as e:
+                # 配置错误、重试队列收尾写库失败等
+                result["error"] = str(e)
+                print(f"[WORKER] 任务执行失败: {e}")
+            finally:
+                self.current = None
+                self.done_count += 1
+                done.set()
+
+    def handle(self, conn):
+        try:
+            while True:
+                msg = conn.recv()
+                op = msg.get("op")
+                if op == "crawl":
+                    done = threading.Event()
+                    result = {"failed": [], "error": None}
+                    self.jobs.put((list(msg.get("urls", [])), msg.get("force", False), done, result))
+                    if msg.get("wait"):
+                        done.wait()
+                        if result["error"]:
+                            conn.send({"ok": False, "msg": result["error"], "failed": result["failed"]})
+                        else:
+                            conn.send({"ok": True, "failed": result["failed"]})
+                    else:
+                        conn.send({"ok": True, "queued": self.jobs.qsize()})
+                elif op == "status":
+                    conn.send({"ok": True, "pending": self.jobs.qsize(),
+                               "current": self.current, "done": self.done_count})
+                else:
+                    conn.send({"ok": False, "msg": f"未知操作: {op}"})
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        threading.Thread(target=self.crawl_loop, daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"[WORKER] 抓取进程已启动，监听 {self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except AuthenticationError:
+                    print("[WORKER] 拒绝未授权的连接")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+# ---------- Web 进程侧 ----------
+
+def _request(msg: dict, config: dict = None) -> dict:
+    config = config if config is not None else load_config()
+    try:
+        conn = Client(get_address(config), authkey=get_authkey(config))
+    except ConnectionRefusedError:
+        raise RuntimeError("抓取进程未启动，请先运行 python crawl_worker.py")
+    with conn:
+        conn.send(msg)
+        return conn.recv()
+
+def submit(urls, force: bool = False, wait: bool = False, config: dict = None) -> dict:
+    return _request({"op": "crawl", "urls": list(urls), "force": force, "wait": wait}, config)
+
+def status(config: dict = None) -> dict:
+    return _request({"op": "status"}, config)
+
+
+if __name__ == '__main__':
+    from db import upgrade_schema
+    upgrade_schema()
+    CrawlWorker(load_config()).serve_forever()
@@ -6,16 +6,26 @@ import io
 import time
 import random
 import uuid
+import json
+import functools
 import requests
 import socket
 import chardet
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 from PIL import Image
-import imagehash
 from models import WebPage, WebImage
-from db import get_session
-import yaml
+from shards import shard_for_write, shard_for_id, shard_session
+from config import load_config
+from urlnorm import normalize_url
+from seen_store import get_seen_store
+from evidence import seal_pending
+from search_cache import get_search_cache
+from watchlist import check_capture
+from http_pool import ConnectionManager
+from image_decode import phash_and_thumbnail, decode_settings
+from retry_policy import (RetryPolicy, FetchError, url_host, classify_status, classify_exception,
+                          parse_retry_after)
 import re
 
 #反爬
@@ -30,9 +40,7 @@ class CrawlerConfig:
         ]
        
         self.REQUEST_DELAY = (1.0, 3.0)
-        self.RETRY_TIMES = 3
-        
-        self.RETRY_DELAY = 5
+        # 重试次数与退避见 retry_policy.py（config.yaml 中 crawler.retry_times / retry_delay）
         self.TIMEOUT = (10, 30)
     
     def get_headers(self):
@@ -64,14 +72,6 @@ class CrawlerConfig:
 # 全局配置实例
 CRAWLER_CONFIG = CrawlerConfig()
 
-def get_config():
-
-    try:
-        with open("config.yaml", encoding="utf-8") as f:
-            return yaml.safe_load(f) or {}
-    except:
-        return {"max_depth": 1, "hamming_threshold": 5}
-
 def get_ip(url: str) -> str:
 
     hostname = urlparse(url).hostname
@@ -82,31 +82,90 @@ def get_ip(url: str) -> str:
     except:
         return ""
 
-def fetch_with_retry(url: str, session: requests.Session, **kwargs): #带重试的请求
+class CrawlRun:
+    # 一次抓取任务（一个或多个种子）共享的状态：连接池、延迟重试队列和失败统计
+    #   with CrawlRun(config) as run:
+    #       fetch_and_save(url, run=run)
 
-    
-    
-    for attempt in range(CRAWLER_CONFIG.RETRY_TIMES):
+    def __init__(self, config: dict = None):
+        self.config = config if config is not None else load_config()
+        self.pool = ConnectionManager(self.config)
+        self.retry = RetryPolicy(self.config)
+        self.started = datetime.datetime.utcnow()
+        self.draining = False
+
+    def drain(self, wait: bool = False, deadline: float = None) -> int:
+        # 执行已到期的延迟重试；wait=True 时等到队列清空或到达 deadline（任务结束前调用）
+        if self.draining:
+            return 0
+        self.draining = True
+        processed = 0
         try:
-            if attempt > 0:
-                delay = random.uniform(*CRAWLER_CONFIG.REQUEST_DELAY) * (attempt + 1)
-                time.sleep(delay)
-            
-            resp = session.get(url, **kwargs)
-            
-            if resp.status_code == 403:
-                print(f"[WARNING] 可能触发反爬: {url}")
-            
-            resp.raise_for_status()
+            while True:
+                item = self.retry.pop_due(wait, deadline)
+                if item is None:
+                    return processed
+                attempts, task = item
+                try:
+                    task(self, attempts)
+                except Exception as e:
+                    # 例如重试成功后写库失败：记录后继续处理队列，不中断整个任务
+                    print(f"[RETRY] 重试任务执行失败: {e}")
+                processed += 1
+        finally:
+            self.draining = False
+
+    def close(self):
+        if len(self.retry):
+            print(f"[RETRY] 等待 {len(self.retry)} 个延迟重试任务...")
+        processed = self.drain(wait=True, deadline=time.monotonic() + self.retry.drain_timeout)
+        self.retry.abandon()  #超过等待时间仍未到期的重试不再执行，避免阻塞调度和工作进程
+        if processed:
+            finish_round(self.config)  #重试成功的记录同样写入 Merkle 批次
+        summary = {
+            "started": self.started.isoformat() + "Z",
+            "finished": datetime.datetime.utcnow().isoformat() + "Z",
+            "requests": self.retry.stats.summary(),
+            "connections": self.pool.stats_summary(),
+        }
+        req = summary["requests"]
+        print(f"[RETRY] 成功 {req['ok']}，永久失败 {req['permanent']}，限流 {req['throttle']}，"
+              f"临时失败 {req['transient']}，熔断跳过 {req['circuit_open']}，"
+              f"重试成功 {req['retried_ok']}，放弃 {req['gave_up']}")
+        try:
+            #每次任务的统计追加到 data_dir/crawl_stats.jsonl
+            data_dir = self.config.get("data_dir", "./data")
+            os.makedirs(data_dir, exist_ok=True)
+            with open(os.path.join(data_dir, "crawl_stats.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"[RETRY] 统计写入失败: {e}")
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def fetch(url: str, run: CrawlRun, **kwargs): #单次请求，失败时抛出已分类的 FetchError，不在这里等待重试
+    host = url_host(url)
+    run.retry.before_request(url, host)
+    try:
+        resp = run.pool.session.get(url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        error = FetchError(url, classify_exception(e), str(e))
+    else:
+        if resp.status_code < 400:
+            run.retry.record_success(host)
             return resp
-        
-        
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] 请求失败 (尝试 {attempt + 1}/{CRAWLER_CONFIG.RETRY_TIMES}): {e}")
-            if attempt == CRAWLER_CONFIG.RETRY_TIMES - 1:
-                raise
-            time.sleep(CRAWLER_CONFIG.RETRY_DELAY)
-    return None
+        if resp.status_code == 403:
+            print(f"[WARNING] 可能触发反爬: {url}")
+        error = FetchError(url, classify_status(resp.status_code), f"HTTP {resp.status_code}",
+                           status=resp.status_code,
+                           retry_after=parse_retry_after(resp.headers.get("Retry-After")))
+    run.retry.record_failure(host, error)
+    raise error
 
 def is_image_url(url: str):
 
@@ -157,40 +216,122 @@ def extract_images_from_css(style_str: str, base_url: str):
     matches = re.findall(pattern, style_str, re.IGNORECASE)
     
     for match in matches:
-        img_url = urljoin(base_url, match.strip())
+        img_url = urljoin(base_url, match.strip()).split("#")[0]
         if is_image_url(img_url):
             images.append(img_url)
     
     return images
 
-def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None):
+def fetch_image(run: CrawlRun, img_url: str, referer: str):
+    #下载图片并计算感知哈希和缩略图，返回 (phash, sha256, 缩略图)；不是有效图片时返回 None
+    img_resp = fetch(img_url, run, headers=CRAWLER_CONFIG.get_image_headers(referer),
+                     timeout=(8, 20))  #图片请求超时稍长
+    if not is_valid_image_response(img_resp): #验证HTTP响应的内容是否确实是有效的图片
+        return None
+    
+    #低分辨率解码一次，同时得到感知哈希和缩略图
+    phash, thumb = phash_and_thumbnail(img_resp.content, decode_settings(run.config))
+    return phash, hashlib.sha256(img_resp.content).hexdigest(), thumb
+
+def retry_page(url: str, depth: int, visited_urls: set, force: bool, run: CrawlRun, attempts: int):
+    fetch_and_save(url, depth, visited_urls, force, run=run, attempts=attempts)
 
+def retry_image(page_id: int, page_url: str, img_url: str, order_index: int, run: CrawlRun, attempts: int):
+    #延迟重试的图片写入所属网页的分片
+    try:
+        result = fetch_image(run, img_url, page_url)
+    except FetchError as e:
+        task = functools.partial(retry_image, page_id, page_url, img_url, order_index)
+        run.retry.defer(task, e, attempts + 1)
+        return
+    except Exception as e:
+        print(f"[IMG]失败: {img_url[:60]}... {str(e)[:30]}")
+        return
+    if result is None:
+        return
+    phash, img_sha256, thumb_bytes = result
+    with shard_session(shard_for_id(page_id)) as s:
+        web_image = WebImage(
+            page_id=page_id,
+            image_url=img_url,
+            phash=phash,
+            sha256=img_sha256,
+            thumb_data=thumb_bytes,
+            order_index=order_index
+        )
+        s.add(web_image)
+        s.commit()
+        image_id = web_image.id
+    run.retry.stats.incr("retried_ok")
+    print(f"[RETRY] 图片重试成功: {img_url[:60]}...")
+    try:
+        get_search_cache(run.config).bump_generation()
+    except Exception as e:
+        print(f"[CACHE] 搜索缓存失效失败: {e}")
+    try:
+        check_capture(run.config, page_id, page_url, "", [(image_id, img_url, phash)])
+    except Exception as e:
+        print(f"[WATCH] 监控匹配失败: {e}")
+
+def finish_round(config: dict):
+    #一轮抓取结束：持久化布隆过滤器，本轮采集记录写入 Merkle 批次
+    get_seen_store(config).flush()
+    try:
+        evidence_cfg = config.get("evidence", {}) or {}
+        seal_pending(config.get("data_dir", "./data"), evidence_cfg.get("batch_size", 50000),
+                     evidence_cfg.get("key_file"))
+    except Exception as e:
+        print(f"[EVIDENCE] 固化失败: {e}")
+
+def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None, force: bool = False,
+                   run: CrawlRun = None, attempts: int = 0):
+    #attempts 为该 URL 已尝试的次数，由延迟重试传入
+    
+    if run is None:
+        #未传入时本次调用（含递归的子页面和图片）共用一个 CrawlRun
+        with CrawlRun() as run:
+            return fetch_and_save(url, depth, visited_urls, force, run)
+    
     if visited_urls is None:
         visited_urls = set()
     
     
     indent = "  " * depth#美观
-    config = get_config()
+    config = load_config()
     max_depth = config.get("max_depth", 1)
     max_links_per_page = config.get("max_links_per_page", 10)
+    seen = get_seen_store(config)
     
-    
-    if url in visited_urls:
+    # 规范化URL只作去重键，抓取和入库仍用原始URL
+    key = normalize_url(url)
+    if key in visited_urls:
         print(f"{indent}[SKIP] URL已访问过: {url[:80]}...") #返回前80个字符
         return
-    visited_urls.add(url)
+    visited_urls.add(key)
+    
+    # 跨运行去重：未到重抓间隔的URL跳过（force 用于种子/手动取证）
+    if not force and not seen.is_due(key):
+        print(f"{indent}[SKIP] 未到重抓间隔: {url[:80]}...")
+        return
     
     print(f"{indent}[FETCH] 开始抓取: {url} (depth={depth}, max_depth={max_depth})")
     
-    with requests.Session() as session: #复用TCP连接
-        try:
-            resp = fetch_with_retry(url, session, timeout=CRAWLER_CONFIG.TIMEOUT, allow_redirects=True)
-            if not resp:
-                print(f"{indent}[SKIP] 请求失败: {url}")
-                return
-        except Exception as e:
+    try:
+        resp = fetch(url, run, timeout=CRAWLER_CONFIG.TIMEOUT, allow_redirects=True)
+    except FetchError as e:
+        #可重试的失败放入延迟队列，当前线程继续处理其他页面
+        task = functools.partial(retry_page, url, depth, visited_urls, force)
+        if run.retry.defer(task, e, attempts + 1):
+            visited_urls.discard(key)
+            print(f"{indent}[RETRY] 稍后重试 ({e.kind}): {url}")
+        else:
             print(f"{indent}[ERROR] fetch {url} -> {e}")
-            return
+        return
+    except Exception as e:
+        print(f"{indent}[ERROR] fetch {url} -> {e}")
+        return
+    if attempts:
+        run.retry.stats.incr("retried_ok")
 
 
     html_bytes = resp.content
@@ -208,8 +349,8 @@ def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None):
     soup = BeautifulSoup(html, "lxml")
     text = soup.get_text(separator=" ", strip=True)
 
-    #保存网页基本信息到数据库
-    with get_session() as s:
+    #保存网页基本信息到当前时间所在的分片
+    with shard_session(shard_for_write(ts, config)) as s:
         page = WebPage(
             url=url,
             ip=ip,
@@ -224,6 +365,39 @@ def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None):
 
         #爬取并保存所有图片
         image_list = []
+        saved_images = []  # 提交后用于监控匹配
+        
+        def save_image(img_url: str, tag: str):
+            try:
+                result = fetch_image(run, img_url, url)
+            except FetchError as e:
+                #可重试的图片保留顺序位置，稍后单独写入
+                task = functools.partial(retry_image, page_id, url, img_url, len(image_list))
+                if run.retry.defer(task, e, 1):
+                    image_list.append(img_url)
+                    print(f"{indent}[RETRY] 图片稍后重试 ({e.kind}): {img_url[:60]}...")
+                else:
+                    print(f"{indent}[IMG]失败: {img_url[:60]}... {str(e)[:30]}")
+                return
+            except Exception as e:
+                print(f"{indent}[IMG]失败: {img_url[:60]}... {str(e)[:30]}")
+                return
+            if result is None:
+                return
+            
+            phash, img_sha256, thumb_bytes = result
+            web_image = WebImage(
+                page_id=page_id,
+                image_url=img_url,
+                phash=phash,
+                sha256=img_sha256,
+                thumb_data=thumb_bytes,
+                order_index=len(image_list)
+            )
+            s.add(web_image)
+            saved_images.append(web_image)
+            image_list.append(img_url) # 标记为已处理
+            print(f"{indent}{tag}: {img_url[:60]}...")
         
         #从<img>标签提取
         for idx, img_tag in enumerate(soup.find_all("img")):
@@ -254,42 +428,7 @@ def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None):
             if img_url in image_list:
                 continue
             
-            try:
-                img_resp = fetch_with_retry(
-                    img_url, 
-                    session, 
-                    headers=CRAWLER_CONFIG.get_image_headers(url),
-                    timeout=(8, 20)  #图片请求超时稍长
-                )
-                if not img_resp or img_resp.status_code != 200: #检查HTTP状态码是否为200
-                    continue
-                
-                if not is_valid_image_response(img_resp):#验证响应头
-                    continue
-                
-                pil_img = Image.open(io.BytesIO(img_resp.content)).convert("RGB")
-                phash = imagehash.phash(pil_img)#计算感知哈希
-                
-                pil_img.thumbnail((320, 320))
-                buf = io.BytesIO()#临时的二进制文件对象
-                pil_img.save(buf, format="JPEG")
-                thumb_bytes = buf.getvalue()
-                
-                
-                web_image = WebImage(
-                    page_id=page_id,
-                    image_url=img_url,
-                    phash=str(phash),
-                    thumb_data=thumb_bytes,
-                    order_index=len(image_list)
-                )
-                s.add(web_image)
-                image_list.append(img_url) # 标记为已处理
-                print(f"{indent}[IMG]成功: {img_url[:60]}...")
-                
-            except Exception as e:
-                print(f"{indent}[IMG]失败: {img_url[:60]}... {str(e)[:30]}")
-                continue
+            save_image(img_url, "[IMG]成功")
         
         #从CSS背景图片提取
         for idx, tag in enumerate(soup.find_all(style=True)):
@@ -300,45 +439,22 @@ def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None):
                 if bg_img_url in image_list:
                     continue
                 
-                try:
-                    img_resp = fetch_with_retry(
-                        bg_img_url,
-                        session,
-                        headers=CRAWLER_CONFIG.get_image_headers(url),
-                        timeout=(8, 20)
-                    )
-                    if not img_resp or img_resp.status_code != 200:
-                        continue
-                    
-                    if not is_valid_image_response(img_resp): #验证HTTP响应的内容是否确实是有效的图片
-                        continue
-                    
-                    pil_img = Image.open(io.BytesIO(img_resp.content)).convert("RGB")
-                    phash = imagehash.phash(pil_img)
-                    
-                    pil_img.thumbnail((320, 320))
-                    buf = io.BytesIO()
-                    pil_img.save(buf, format="JPEG")
-                    thumb_bytes = buf.getvalue()
-                    
-
-
-                    web_image = WebImage(
-                        page_id=page_id,
-                        image_url=bg_img_url,
-                        phash=str(phash),
-                        thumb_data=thumb_bytes,
-                        order_index=len(image_list)
-                    )
-                    s.add(web_image)
-                    image_list.append(bg_img_url)
-                    print(f"{indent}[BG]背景图: {bg_img_url[:60]}...")
-                    
-                except Exception as e:
-                    continue
+                save_image(bg_img_url, "[BG]背景图")
         
         s.commit()
         print(f"{indent}[SUCCESS] {url} 图片总数={len(image_list)}")
+        
+        #监控清单匹配：只处理本次新入库的正文和图片
+        try:
+            check_capture(config, page_id, url, text,
+                          [(img.id, img.image_url, img.phash) for img in saved_images])
+        except Exception as e:
+            print(f"{indent}[WATCH] 监控匹配失败: {e}")
+    try:
+        get_search_cache(config).bump_generation() #新数据已提交，搜索缓存失效
+    except Exception as e:
+        print(f"{indent}[CACHE] 搜索缓存失效失败: {e}")
+    seen.mark_seen(key)
 
     #深度爬取
     if depth < max_depth:
@@ -361,13 +477,17 @@ def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None):
                 if any(next_url.startswith(skip) for skip in ['javascript:', 'mailto:', 'tel:', '#', 'data:']):#过滤JavaScript、邮件、电话、锚点、Base64等特殊协议
                     continue
                 
-                if next_url in unique_urls:
+                next_key = normalize_url(next_url)
+                if next_key in unique_urls or next_key in visited_urls:
+                    continue
+                unique_urls.add(next_key)
+                
+                if not seen.is_due(next_key): #未到重抓间隔，不占用链接名额也不等待
                     continue
-                unique_urls.add(next_url)
                 
                 print(f"{indent} └─ [{links_processed+1}] 爬取: {next_url[:80]}...")
                 time.sleep(random.uniform(0.5, 1.5))
-                fetch_and_save(next_url, depth + 1, visited_urls) #递归
+                fetch_and_save(next_url, depth + 1, visited_urls, run=run) #递归
                 links_processed += 1
                 
                 if links_processed >= max_links_per_page:
@@ -378,4 +498,8 @@ def fetch_and_save(url: str, depth: int = 0, visited_urls: set = None):
         
         print(f"{indent}[DEEP] 本次共处理 {links_processed} 个有效内链")
     else:
-        print(f"{indent}[DEEP] 已达到最大深度 {max_depth}，不再继续爬取")
\ No newline at end of file
+        print(f"{indent}[DEEP] 已达到最大深度 {max_depth}，不再继续爬取")
+
+    if depth == 0:
+        run.drain() #已到期的延迟重试，未到期的在 CrawlRun 结束时处理
+        finish_round(config)
\ No newline at end of file
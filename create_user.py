@@ -1,5 +1,5 @@
 # create_user.py
-from db import engine, get_db_path
+from db import engine, get_db_path, upgrade_schema
 from sqlalchemy import text
 from werkzeug.security import generate_password_hash
 import getpass
@@ -51,6 +51,7 @@ def main():
     print("-" * 50)
     
     # 确保表存在
+    upgrade_schema()
     create_user_table()
     
     # 输入用户信息
@@ -1,12 +1,36 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.orm import sessionmaker
 from models import Base
 
 
 DB_FILE = "forensic.db"
 engine = create_engine(f"sqlite:///{DB_FILE}", echo=False, future=True)
-Base.metadata.create_all(bind=engine)
+
+# 旧库上需要补加的列: (表, 列, 类型)
+ADDED_COLUMNS = [
+    ("webimages", "sha256", "VARCHAR(64)"),
+]
+
+def add_missing_columns(target_engine):
+    # 已有表的新列在这里补上（主库与各分片共用）
+    insp = inspect(target_engine)
+    tables = set(insp.get_table_names())
+    with target_engine.begin() as conn:
+        # WAL 模式允许多个进程同时读、一个进程写
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        for table, column, col_type in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            existing = {c["name"] for c in insp.get_columns(table)}
+            if column not in existing:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
+def upgrade_schema():
+    # create_all 只建新表，不会修改已有表
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+
 Session = sessionmaker(bind=engine, expire_on_commit=False)
 
 def get_session():
@@ -0,0 +1,319 @@
+# evidence.py
+# 采集证据的 Merkle 树批量固化：每批采集记录（网页哈希 + 图片内容哈希）生成一个根，
+# 根写入 Ed25519 签名的清单，每条记录保存自己的包含证明，可单独验证。
+# 私钥放在 data_dir 之外，清单内嵌公钥，第三方只需发布的公钥即可验证
+import os
+import json
+import hmac
+import hashlib
+import datetime
+import threading
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+from models import WebPage, WebImage, EvidenceBatch, EvidenceLeaf
+from db import get_session
+from shards import list_shards, shard_for_id, shard_session
+
+ALGORITHM = "sha256-merkle-rfc6962"
+SIGNATURE_ALG = "ed25519"
+DEFAULT_BATCH_SIZE = 50000
+
+_seal_lock = threading.Lock()
+
+
+# ---------- Merkle 树 ----------
+# 叶子与内部节点使用不同前缀（RFC 6962），落单节点直接上提而不是复制
+
+def leaf_hash(data: bytes) -> bytes:
+    return hashlib.sha256(b"\x00" + data).digest()
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+def merkle_levels(leaves: list) -> list:
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        cur = levels[-1]
+        nxt = []
+        for i in range(0, len(cur), 2):
+            nxt.append(node_hash(cur[i], cur[i + 1]) if i + 1 < len(cur) else cur[i])
+        levels.append(nxt)
+    return levels
+
+def merkle_root(leaves: list) -> bytes:
+    if not leaves:
+        return hashlib.sha256(b"").digest()
+    return merkle_levels(leaves)[-1][0]
+
+def merkle_proof(levels: list, index: int) -> list:
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(["L" if sibling < index else "R", level[sibling].hex()])
+        index //= 2
+    return proof
+
+def verify_proof(leaf: bytes, proof: list, root: bytes) -> bool:
+    h = leaf
+    for side, sibling_hex in proof:
+        sibling = bytes.fromhex(sibling_hex)
+        h = node_hash(sibling, h) if side == "L" else node_hash(h, sibling)
+    return hmac.compare_digest(h, root)
+
+
+# ---------- 叶子编码 ----------
+# 规范化 JSON 数组，字段顺序固定，避免分隔符歧义
+
+def _canonical(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+def _ts(ts) -> str:
+    return ts.isoformat() if isinstance(ts, datetime.datetime) else str(ts)
+
+def page_leaf(page_id, url, ip, timestamp, html_sha256) -> bytes:
+    return leaf_hash(_canonical(["page", page_id, url, ip, _ts(timestamp), html_sha256]))
+
+def image_leaf(image_id, page_id, image_url, content_sha256, phash, thumb_sha256) -> bytes:
+    return leaf_hash(_canonical(["image", image_id, page_id, image_url, content_sha256, phash, thumb_sha256]))
+
+def sha256_hex(data) -> str:
+    return hashlib.sha256(data or b"").hexdigest()
+
+
+# ---------- 签名 ----------
+
+# 私钥不自动生成：与证据放在一起的话，能改记录的人也能重新签名
+
+def load_signing_key(key_file: str = None, data_dir: str = "./data") -> Ed25519PrivateKey:
+    # key_file 为空时读取环境变量 EVIDENCE_KEY_FILE
+    key_file = key_file or os.getenv("EVIDENCE_KEY_FILE")
+    if not key_file:
+        raise RuntimeError("未配置签名私钥：先运行 python audit.py --gen-key <路径>，"
+                           "再设置 evidence.key_file 或环境变量 EVIDENCE_KEY_FILE")
+    key_path = os.path.realpath(key_file)
+    data_path = os.path.realpath(data_dir)
+    if os.path.commonpath([key_path, data_path]) == data_path:
+        raise RuntimeError(f"签名私钥不能放在 data_dir ({data_dir}) 内")
+    with open(key_path, "rb") as f:
+        key = serialization.load_pem_private_key(f.read(), password=None)
+    if not isinstance(key, Ed25519PrivateKey):
+        raise RuntimeError("签名私钥必须是 Ed25519 密钥")
+    return key
+
+def generate_signing_key(key_file: str) -> str:
+    # 生成新的私钥文件（已存在时报错），返回公钥 hex
+    key = Ed25519PrivateKey.generate()
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption())
+    fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+    return public_key_hex(key)
+
+def public_key_hex(key: Ed25519PrivateKey) -> str:
+    return key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw).hex()
+
+def key_fingerprint(public_hex: str) -> str:
+    return hashlib.sha256(bytes.fromhex(public_hex)).hexdigest()
+
+def trusted_public_key(config: dict) -> str:
+    # 对外发布的公钥；验证时要求清单内嵌的公钥与之一致，否则换一把私钥就能重新签名
+    evidence_cfg = (config or {}).get("evidence", {}) or {}
+    value = os.getenv("EVIDENCE_PUBLIC_KEY") or evidence_cfg.get("public_key") or ""
+    return value.strip().lower() or None
+
+def sign_manifest(manifest_json: str, key: Ed25519PrivateKey) -> str:
+    return key.sign(manifest_json.encode("utf-8")).hex()
+
+def verify_manifest(manifest_json: str, signature: str, trusted_key: str = None) -> dict:
+    # 只用公钥验证；key_trusted 为 None 表示未配置发布的公钥，无法确认签名者
+    manifest = json.loads(manifest_json)
+    public_hex = manifest.get("public_key")
+    result = {"signature_ok": False, "key_trusted": None, "public_key": public_hex,
+              "key_fingerprint": None, "error": None}
+    if not public_hex:
+        result["error"] = "清单缺少公钥"
+        return result
+    result["key_fingerprint"] = key_fingerprint(public_hex)
+    try:
+        Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_hex)).verify(
+            bytes.fromhex(signature), manifest_json.encode("utf-8"))
+        result["signature_ok"] = True
+    except (InvalidSignature, ValueError):
+        result["error"] = "清单签名无效"
+    if trusted_key:
+        result["key_trusted"] = hmac.compare_digest(public_hex, trusted_key)
+        if not result["key_trusted"]:
+            result["error"] = result["error"] or "清单公钥与发布的公钥不一致"
+    return result
+
+def manifest_path(data_dir: str, batch_id: int) -> str:
+    return os.path.join(data_dir, "manifests", f"batch_{batch_id:06d}.json")
+
+
+# ---------- 固化 ----------
+
+def _sealed_watermark(s, kind: str, shard) -> int:
+    # 分片内 id 按提交顺序递增，已固化的记录总是前缀，取最大已固化 id 即可
+    hwm = s.scalar(select(func.max(EvidenceLeaf.ref_id)).where(
+        EvidenceLeaf.kind == kind, EvidenceLeaf.ref_id.between(shard.id_min, shard.id_max)))
+    return hwm if hwm is not None else shard.id_min - 1
+
+def _pending_leaves(s, limit: int):
+    # 尚未进入任何批次的网页和图片，逐个分片按 (类型, id) 顺序排列
+    leaves = []
+    for shard in list_shards():
+        if len(leaves) >= limit:
+            break
+        page_hwm = _sealed_watermark(s, "page", shard)
+        image_hwm = _sealed_watermark(s, "image", shard)
+        with shard_session(shard) as ss:
+            pages = ss.execute(
+                select(WebPage.id, WebPage.url, WebPage.ip, WebPage.timestamp, WebPage.sha256)
+                .where(WebPage.id > page_hwm)
+                .order_by(WebPage.id)
+                .limit(limit - len(leaves))
+            )
+            for row in pages:
+                leaves.append(("page", row.id, page_leaf(row.id, row.url, row.ip, row.timestamp, row.sha256)))
+
+            if len(leaves) < limit:
+                images = ss.execute(
+                    select(WebImage.id, WebImage.page_id, WebImage.image_url, WebImage.sha256,
+                           WebImage.phash, WebImage.thumb_data)
+                    .where(WebImage.id > image_hwm)
+                    .order_by(WebImage.id)
+                    .limit(limit - len(leaves))
+                )
+                for row in images:
+                    leaves.append(("image", row.id, image_leaf(
+                        row.id, row.page_id, row.image_url, row.sha256, row.phash, sha256_hex(row.thumb_data))))
+    return leaves
+
+def seal_pending(data_dir: str = "./data", batch_size: int = DEFAULT_BATCH_SIZE, key_file: str = None) -> list:
+    # 把所有未固化的采集记录写入新的 Merkle 批次，返回新批次 id 列表
+    key = load_signing_key(key_file, data_dir)
+    public_hex = public_key_hex(key)
+    batch_ids = []
+    with _seal_lock:
+        while True:
+            with get_session() as s:
+                leaves = _pending_leaves(s, batch_size)
+                if not leaves:
+                    break
+
+                hashes = [h for _, _, h in leaves]
+                levels = merkle_levels(hashes)
+                root = levels[-1][0].hex()
+                created_at = datetime.datetime.utcnow()
+
+                batch = EvidenceBatch(created_at=created_at, root=root, leaf_count=len(leaves),
+                                      manifest="", signature="")
+                s.add(batch)
+                s.flush()
+
+                manifest = {
+                    "batch_id": batch.id,
+                    "algorithm": ALGORITHM,
+                    "created_at": created_at.isoformat() + "Z",
+                    "leaf_count": len(leaves),
+                    "pages": sum(1 for kind, _, _ in leaves if kind == "page"),
+                    "images": sum(1 for kind, _, _ in leaves if kind == "image"),
+                    "root": root,
+                    "signature_alg": SIGNATURE_ALG,
+                    "public_key": public_hex,
+                    "key_fingerprint": key_fingerprint(public_hex),
+                }
+                batch.manifest = _canonical(manifest).decode("utf-8")
+                batch.signature = sign_manifest(batch.manifest, key)
+
+                for index, (kind, ref_id, h) in enumerate(leaves):
+                    s.add(EvidenceLeaf(
+                        batch_id=batch.id, leaf_index=index, kind=kind, ref_id=ref_id,
+                        leaf_hash=h.hex(), proof=json.dumps(merkle_proof(levels, index)),
+                    ))
+                try:
+                    s.commit()
+                except IntegrityError:
+                    # 其他进程已固化了同一批记录
+                    s.rollback()
+                    continue
+
+                # 清单另存一份到数据库之外
+                path = manifest_path(data_dir, batch.id)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump({"manifest": manifest, "signature": batch.signature}, f,
+                              ensure_ascii=False, indent=2)
+                batch_ids.append(batch.id)
+                print(f"[EVIDENCE] 批次 {batch.id} 已固化: {len(leaves)} 条记录, root={root[:16]}...")
+    return batch_ids
+
+
+# ---------- 单条证明 ----------
+
+def recompute_leaf(kind: str, ref_id: int) -> bytes:
+    # 从记录所在分片读取当前内容重新计算叶子；记录不存在或分片下线时返回 None
+    shard = shard_for_id(ref_id)
+    if shard is None or shard.state == "offline":
+        return None
+    with shard_session(shard) as s:
+        if kind == "page":
+            row = s.execute(
+                select(WebPage.id, WebPage.url, WebPage.ip, WebPage.timestamp, WebPage.html)
+                .where(WebPage.id == ref_id)
+            ).first()
+            return page_leaf(row.id, row.url, row.ip, row.timestamp,
+                             sha256_hex((row.html or "").encode("utf-8"))) if row else None
+        row = s.execute(
+            select(WebImage.id, WebImage.page_id, WebImage.image_url, WebImage.sha256,
+                   WebImage.phash, WebImage.thumb_data)
+            .where(WebImage.id == ref_id)
+        ).first()
+        return image_leaf(row.id, row.page_id, row.image_url, row.sha256, row.phash,
+                          sha256_hex(row.thumb_data)) if row else None
+
+def prove_capture(kind: str, ref_id: int, trusted_key: str = None) -> dict:
+    # 返回单条记录的叶子、包含证明、批次清单及验证结果，无需读取同批其他记录
+    with get_session() as s:
+        leaf = s.execute(
+            select(EvidenceLeaf).where(EvidenceLeaf.kind == kind, EvidenceLeaf.ref_id == ref_id)
+        ).scalar_one_or_none()
+        if leaf is None:
+            return None
+        batch = s.get(EvidenceBatch, leaf.batch_id)
+
+    current = recompute_leaf(kind, ref_id)
+    proof = json.loads(leaf.proof)
+    signature = verify_manifest(batch.manifest, batch.signature, trusted_key)
+    return {
+        "kind": kind,
+        "ref_id": ref_id,
+        "leaf_index": leaf.leaf_index,
+        "leaf_hash": leaf.leaf_hash,
+        "proof": proof,
+        "manifest": json.loads(batch.manifest),
+        "signature": batch.signature,
+        "signature_alg": SIGNATURE_ALG,
+        "public_key": signature["public_key"],
+        "key_fingerprint": signature["key_fingerprint"],
+        "signature_ok": signature["signature_ok"],
+        "key_trusted": signature["key_trusted"],
+        "content_ok": current is not None and current.hex() == leaf.leaf_hash,
+        "proof_ok": verify_proof(bytes.fromhex(leaf.leaf_hash), proof, bytes.fromhex(batch.root)),
+    }
+
+def count_unsealed() -> dict:
+    pages = images = 0
+    with get_session() as s:
+        for shard in list_shards():
+            page_hwm = _sealed_watermark(s, "page", shard)
+            image_hwm = _sealed_watermark(s, "image", shard)
+            with shard_session(shard) as ss:
+                pages += ss.scalar(select(func.count(WebPage.id)).where(WebPage.id > page_hwm))
+                images += ss.scalar(select(func.count(WebImage.id)).where(WebImage.id > image_hwm))
+    return {"pages": pages, "images": images}
@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+# 多进程部署配置：gunicorn -c gunicorn.conf.py wsgi:application
+import os
+import multiprocessing
+
+bind = os.getenv("BIND", "127.0.0.1:5000")
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = 4
+preload_app = False  # 每个 worker 自己加载 wsgi.py 并启动选主线程
+timeout = 300  # 即时取证请求会等待抓取完成
+
+
+def on_starting(server):
+    # 所有 worker 共用同一个 SECRET_KEY，否则登录会话只在单个进程内有效
+    os.environ.setdefault("SECRET_KEY", os.urandom(24).hex())
+
+    from app import init_config_file, CONFIG_PATH
+    from db import engine, upgrade_schema
+    if not os.path.exists(CONFIG_PATH):
+        init_config_file()
+    upgrade_schema()
+    engine.dispose()  # 不把主进程的数据库连接带进 fork 出的 worker
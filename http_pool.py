@@ -0,0 +1,155 @@
+# http_pool.py
+# 一次抓取任务共用的 HTTP 连接管理：所有网页和图片请求走同一个 Session，
+# 按主机维护 keep-alive 连接池（可单独设置大小），空闲超时的主机连接池自动关闭，
+# 并统计新建连接与复用连接的次数
+import time
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_MAX_HOSTS = 100
+DEFAULT_IDLE_TIMEOUT = 30  # 秒
+EVICT_INTERVAL = 5
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}  # "host:port" -> {"requests": n, "new": n}
+
+    def _host(self, host):
+        return self.hosts.setdefault(host, {"requests": 0, "new": 0})
+
+    def record_request(self, host):
+        with self.lock:
+            self._host(host)["requests"] += 1
+
+    def record_new(self, host):
+        with self.lock:
+            self._host(host)["new"] += 1
+
+    def summary(self) -> dict:
+        with self.lock:
+            total = sum(h["requests"] for h in self.hosts.values())
+            new = sum(h["new"] for h in self.hosts.values())
+            hosts = {host: dict(h, reused=max(h["requests"] - h["new"], 0)) for host, h in self.hosts.items()}
+        reused = max(total - new, 0)
+        return {
+            "requests": total,
+            "new_connections": new,
+            "reused": reused,
+            "reuse_rate": round(reused / total, 4) if total else 0.0,
+            "hosts": hosts,
+        }
+
+
+def host_key(url: str):
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    return scheme, (parsed.hostname or "").lower(), parsed.port or (443 if scheme == "https" else 80)
+
+def _counting_pool_class(base, stats: PoolStats):
+    # 每个管理器生成自己的连接池子类，新建连接时计数
+    class CountingPool(base):
+        def _new_conn(self):
+            stats.record_new(f"{self.host}:{self.port}")
+            return super()._new_conn()
+    return CountingPool
+
+
+class PooledAdapter(HTTPAdapter):
+
+    def __init__(self, stats: PoolStats, pool_maxsize: int, max_hosts: int,
+                 host_pool_sizes: dict, idle_timeout: float):
+        self.stats = stats
+        self.host_pool_sizes = {h.lower(): int(n) for h, n in (host_pool_sizes or {}).items()}
+        self.idle_timeout = idle_timeout
+        self.last_used = {}  # (scheme, host, port) -> 最近使用时间
+        self.evicted = 0
+        self.last_evict = time.monotonic()
+        self.evict_lock = threading.Lock()
+        super().__init__(pool_connections=max_hosts, pool_maxsize=pool_maxsize)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.stats),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.stats),
+        }
+
+    def get_connection(self, url, proxies=None):
+        # 无代理时按主机取连接池，使用该主机单独配置的大小
+        if proxies and any(proxies.values()):
+            return super().get_connection(url, proxies)
+        scheme, host, port = host_key(url)
+        pool_kwargs = None
+        if host in self.host_pool_sizes:
+            pool_kwargs = {"maxsize": self.host_pool_sizes[host]}
+        return self.poolmanager.connection_from_host(host, port=port, scheme=scheme, pool_kwargs=pool_kwargs)
+
+    def send(self, request, **kwargs):
+        key = host_key(request.url)
+        self.stats.record_request(f"{key[1]}:{key[2]}")
+        self.last_used[key] = time.monotonic()
+        self.evict_idle()
+        return super().send(request, **kwargs)
+
+    def evict_idle(self, force: bool = False):
+        # 关闭超过 idle_timeout 未使用的主机连接池，释放服务器端早已不再保持的 keep-alive 连接
+        now = time.monotonic()
+        if not force and now - self.last_evict < EVICT_INTERVAL:
+            return
+        with self.evict_lock:
+            self.last_evict = now
+            idle = {key for key, used in self.last_used.items() if now - used > self.idle_timeout}
+            if not idle:
+                return
+            for pool_key in self.poolmanager.pools.keys():
+                if (pool_key.key_scheme, pool_key.key_host, pool_key.key_port) in idle:
+                    self.poolmanager.pools.pop(pool_key, None)
+                    self.evicted += 1
+            for key in idle:
+                self.last_used.pop(key, None)
+
+
+class ConnectionManager:
+    # 用法：with ConnectionManager(config) as pool: pool.session.get(...)
+
+    def __init__(self, config: dict = None):
+        http_cfg = (config or {}).get("http", {}) or {}
+        self.stats = PoolStats()
+        self.adapter = PooledAdapter(
+            self.stats,
+            pool_maxsize=int(http_cfg.get("pool_maxsize", DEFAULT_POOL_MAXSIZE)),
+            max_hosts=int(http_cfg.get("max_hosts", DEFAULT_MAX_HOSTS)),
+            host_pool_sizes=http_cfg.get("host_pool_sizes", {}),
+            idle_timeout=float(http_cfg.get("idle_timeout", DEFAULT_IDLE_TIMEOUT)),
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def get(self, url: str, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def stats_summary(self) -> dict:
+        summary = self.stats.summary()
+        summary["evicted"] = self.adapter.evicted
+        return summary
+
+    def close(self):
+        summary = self.stats_summary()
+        if summary["requests"]:
+            print(f"[POOL] 请求 {summary['requests']} 次，新建连接 {summary['new_connections']}，"
+                  f"复用 {summary['reused']}（{summary['reuse_rate']:.0%}），空闲回收 {summary['evicted']} 个主机连接池")
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
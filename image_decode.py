@@ -0,0 +1,186 @@
+# image_decode.py
+# 低分辨率解码快速路径：phash 只用 32x32、缩略图最大 320x320，不需要把大图完整解码。
+# JPEG 用 draft() 在 DCT 阶段直接按 1/2、1/4、1/8 缩小解码，其他格式解码后先 reduce() 整数倍缩小；
+# phash 和缩略图都取自这一张缩小后的图。
+#   python image_decode.py verify [图片或目录...] [--tolerance 4]   对比全分辨率 phash
+#   python image_decode.py bench [图片或目录...] [--repeat 3]        吞吐对比
+# 不指定图片时生成模拟图库大图的测试图
+import os
+import io
+import sys
+import time
+from PIL import Image
+import imagehash
+
+THUMB_SIZE = (320, 320)
+REDUCE_GAP = 2  # 缩小后至少保留目标尺寸的 2 倍，再做高质量缩放
+DEFAULT_TOLERANCE = 4
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff')
+
+
+def decode_settings(config: dict) -> dict:
+    decode_cfg = (config or {}).get("image_decode", {}) or {}
+    return {
+        "fast_path": bool(decode_cfg.get("fast_path", True)),
+        "verify": bool(decode_cfg.get("verify", False)),
+        "tolerance": int(decode_cfg.get("tolerance", DEFAULT_TOLERANCE)),
+    }
+
+
+def decode_full(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+def decode_reduced(data: bytes, size=THUMB_SIZE) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    target = (size[0] * REDUCE_GAP, size[1] * REDUCE_GAP)
+    img.draft("RGB", target)  # 只对 JPEG 生效，必须在 load 之前调用
+    img = img.convert("RGB")
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+def reduced_phash(data: bytes) -> imagehash.ImageHash:
+    return imagehash.phash(decode_reduced(data))
+
+def _thumbnail_bytes(img: Image.Image) -> bytes:
+    img.thumbnail(THUMB_SIZE)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG")
+    return buf.getvalue()
+
+def phash_and_thumbnail(data: bytes, settings: dict = None):
+    # 返回 (phash 十六进制, 缩略图 JPEG 字节)
+    settings = settings or decode_settings({})
+    if not settings["fast_path"]:
+        img = decode_full(data)
+        return str(imagehash.phash(img)), _thumbnail_bytes(img)
+
+    img = decode_reduced(data)
+    phash = imagehash.phash(img)
+    if settings["verify"]:
+        # 校验模式：同时计算全分辨率 phash，超出容差时记录并以全分辨率结果为准
+        full = imagehash.phash(decode_full(data))
+        distance = int(phash - full)
+        if distance > settings["tolerance"]:
+            print(f"[DECODE] phash 偏差 {distance} 超出容差 {settings['tolerance']}，使用全分辨率结果")
+            phash = full
+    return str(phash), _thumbnail_bytes(img)
+
+
+# ---------- 命令行：校验与基准 ----------
+
+def _load(paths) -> list:
+    # 读取指定的图片文件/目录；未指定时生成测试图
+    if not paths:
+        print("[DECODE] 未指定图片，生成 8 张 4000x3000 JPEG 测试图...")
+        return _sample_images()
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(IMAGE_EXTS))
+        else:
+            files.append(path)
+    samples = []
+    for path in files:
+        with open(path, "rb") as f:
+            samples.append((path, f.read()))
+    return samples
+
+def _option(args: list, name: str, default):
+    if name in args:
+        i = args.index(name)
+        value = type(default)(args[i + 1])
+        del args[i:i + 2]
+        return value
+    return default
+
+def _sample_images(count: int = 8) -> list:
+    # 模拟图库大图：渐变 + 图形 + 噪声，保存为 4000x3000 JPEG
+    from PIL import ImageDraw
+    import random
+    rng = random.Random(0)
+    samples = []
+    for i in range(count):
+        img = Image.radial_gradient("L").resize((4000, 3000)).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        for _ in range(40):
+            x, y = rng.randrange(4000), rng.randrange(3000)
+            r = rng.randrange(50, 600)
+            draw.ellipse((x - r, y - r, x + r, y + r),
+                         fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        img = Image.blend(img, Image.effect_noise((4000, 3000), 40).convert("RGB"), 0.15)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+        samples.append((f"sample_{i}.jpg", buf.getvalue()))
+    return samples
+
+def verify(paths, tolerance: int) -> bool:
+    distances = []
+    failed = []
+    for path, data in _load(paths):
+        try:
+            fast = reduced_phash(data)
+            full = imagehash.phash(decode_full(data))
+        except Exception as e:
+            print(f"[VERIFY] 跳过 {path}: {e}")
+            continue
+        distance = int(fast - full)
+        distances.append(distance)
+        if distance > tolerance:
+            failed.append((path, distance))
+            print(f"[VERIFY] 超出容差: {path} 距离 {distance}")
+    if not distances:
+        print("没有可校验的图片")
+        return False
+    histogram = {d: distances.count(d) for d in sorted(set(distances))}
+    print(f"[VERIFY] 共 {len(distances)} 张，最大距离 {max(distances)}，"
+          f"平均 {sum(distances) / len(distances):.2f}，分布 {histogram}")
+    print(f"[VERIFY] 容差 {tolerance}：{'全部通过' if not failed else f'{len(failed)} 张超出'}")
+    return not failed
+
+def bench(paths, repeat: int):
+    samples = _load(paths)
+    if not samples:
+        print("[BENCH] 未找到图片")
+        return
+    total_bytes = sum(len(d) for _, d in samples)
+
+    def run(decode, data):
+        # 返回解码后的像素数；thumbnail 会原地缩小，需先记录
+        img = decode(data)
+        pixels = img.width * img.height
+        imagehash.phash(img)
+        _thumbnail_bytes(img)
+        return pixels
+
+    results = {}
+    for name, decode in (("全分辨率", decode_full), ("快速路径", decode_reduced)):
+        pixels = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for _, data in samples:
+                pixels = max(pixels, run(decode, data))
+        elapsed = time.perf_counter() - start
+        count = len(samples) * repeat
+        results[name] = elapsed
+        print(f"[BENCH] {name}: {count / elapsed:.1f} 张/秒，{elapsed / count * 1000:.1f} 毫秒/张，"
+              f"{total_bytes * repeat / elapsed / 1024 / 1024:.1f} MB/秒，最大解码尺寸 {pixels * 3 / 1024 / 1024:.1f} MB")
+    print(f"[BENCH] 加速 {results['全分辨率'] / results['快速路径']:.1f} 倍")
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == "verify":
+        tolerance = _option(args, "--tolerance", DEFAULT_TOLERANCE)
+        sys.exit(0 if verify(args[1:], tolerance) else 1)
+    elif args and args[0] == "bench":
+        repeat = _option(args, "--repeat", 3)
+        bench(args[1:], repeat)
+    else:
+        print("用法:\n  python image_decode.py verify [图片或目录...] [--tolerance 4]\n"
+              "  python image_decode.py bench [图片或目录...] [--repeat 3]")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# leader.py
+# 多进程部署下的调度器选主：各进程通过数据库租约竞争，只有持有租约的 leader 运行 APScheduler；
+# 启动/停止请求写入共享的 scheduler_state 行，任意进程都能发起并读取状态
+import os
+import time
+import atexit
+import socket
+import uuid
+import datetime
+import threading
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+from models import SchedulerState
+from db import get_session
+
+LEASE_SECONDS = 15
+HEARTBEAT_SECONDS = 5
+STATE_ID = 1
+
+
+def _utc(dt):
+    # APScheduler 返回带时区的时间，统一存为 UTC naive
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _iso(dt):
+    return dt.isoformat() + "Z" if dt else None
+
+
+class SchedulerLeader:
+
+    def __init__(self, job_func, load_trigger):
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.job_func = job_func
+        self.load_trigger = load_trigger  # 返回 APScheduler trigger，读取最新配置
+        self.scheduler = None
+        self.applied_generation = None
+        self.is_leader = False
+        self.renewed_at = None  # 最近一次成功续约的 time.monotonic()
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.release)
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[LEADER] 心跳失败: {e}")
+                self._check_lease()
+            self.wakeup.wait(HEARTBEAT_SECONDS)
+            self.wakeup.clear()
+
+    def _ensure_row(self, s):
+        if s.get(SchedulerState, STATE_ID) is None:
+            try:
+                s.add(SchedulerState(id=STATE_ID, desired_running=False, generation=0, running=False))
+                s.commit()
+            except IntegrityError:
+                s.rollback()
+
+    def _check_lease(self):
+        # 续约失败时租约照样会过期，其他进程随后就能接管；在那之前停掉本地调度器，避免同时有两个 leader
+        with self.lock:
+            if not self.is_leader:
+                return
+            if self.renewed_at is None or time.monotonic() - self.renewed_at >= LEASE_SECONDS - HEARTBEAT_SECONDS:
+                print(f"[LEADER] {self.node_id} 续约失败，租约即将过期，放弃 leader 身份")
+                self.is_leader = False
+                self._stop_local()
+
+    def tick(self):
+        # 续约或抢占过期租约，再按期望状态调整本地调度器
+        with self.lock:
+            started = time.monotonic()  # 早于写入的过期时间，按此计算租约剩余时间更保守
+            now = datetime.datetime.utcnow()
+            with get_session() as s:
+                self._ensure_row(s)
+                result = s.execute(
+                    update(SchedulerState)
+                    .where(SchedulerState.id == STATE_ID, or_(
+                        SchedulerState.leader_id == self.node_id,
+                        SchedulerState.lease_expires.is_(None),
+                        SchedulerState.lease_expires < now,
+                    ))
+                    .values(leader_id=self.node_id,
+                            lease_expires=now + datetime.timedelta(seconds=LEASE_SECONDS))
+                )
+                s.commit()
+                leader = result.rowcount == 1
+                if leader:
+                    self.renewed_at = started
+                state = s.get(SchedulerState, STATE_ID)
+                desired_running, generation = state.desired_running, state.generation
+
+            if leader != self.is_leader:
+                print(f"[LEADER] {self.node_id} {'成为调度器 leader' if leader else '失去 leader 身份'}")
+            self.is_leader = leader
+            if not leader:
+                self._stop_local()
+                return
+
+            if desired_running:
+                if self.scheduler is None or self.applied_generation != generation:
+                    self._start_local()
+                    self.applied_generation = generation
+            else:
+                self._stop_local()
+            self._publish()
+
+    def _start_local(self):
+        from apscheduler.schedulers.background import BackgroundScheduler
+        trigger = self.load_trigger()
+        if self.scheduler is None:
+            self.scheduler = BackgroundScheduler()
+        else:
+            self.scheduler.remove_all_jobs()
+        self.scheduler.add_job(self.job_func, trigger, id='crawl_job')
+        if not self.scheduler.running:
+            self.scheduler.start()
+        print("[LEADER] 本进程调度器已启动")
+
+    def _stop_local(self):
+        if self.scheduler is not None:
+            self.scheduler.shutdown(wait=False)
+            self.scheduler = None
+            print("[LEADER] 本进程调度器已停止")
+        self.applied_generation = None
+
+    def _publish(self):
+        # leader 回写运行状态，供其他进程的 /api/scheduler_status 读取
+        running = self.scheduler is not None and self.scheduler.running
+        next_run = None
+        if running and self.scheduler.get_jobs():
+            next_run = _utc(self.scheduler.get_jobs()[0].next_run_time)
+        with get_session() as s:
+            s.execute(
+                update(SchedulerState)
+                .where(SchedulerState.id == STATE_ID, SchedulerState.leader_id == self.node_id)
+                .values(running=running, next_run=next_run)
+            )
+            s.commit()
+
+    def request(self, running: bool):
+        # 任意进程调用：写入期望状态，本进程若是 leader 立即生效，否则在下个心跳内由 leader 执行
+        with get_session() as s:
+            self._ensure_row(s)
+            values = {"desired_running": running}
+            if running:
+                values["generation"] = SchedulerState.generation + 1
+            s.execute(update(SchedulerState).where(SchedulerState.id == STATE_ID).values(**values))
+            s.commit()
+        self.tick()
+
+    def record_run(self):
+        with get_session() as s:
+            s.execute(
+                update(SchedulerState).where(SchedulerState.id == STATE_ID)
+                .values(last_run=datetime.datetime.utcnow())
+            )
+            s.commit()
+
+    def status(self) -> dict:
+        with get_session() as s:
+            state = s.get(SchedulerState, STATE_ID)
+        if state is None:
+            return {'running': False, 'last_run': None, 'next_run': None, 'leader': None}
+        alive = state.lease_expires is not None and state.lease_expires >= datetime.datetime.utcnow()
+        return {
+            'running': bool(state.desired_running) and alive,
+            'last_run': _iso(state.last_run),
+            'next_run': _iso(state.next_run) if state.running else None,
+            'leader': state.leader_id if alive else None,
+        }
+
+    def release(self):
+        # 进程退出时主动释放租约，其他进程无需等到过期即可接管
+        with self.lock:
+            self._stop_local()
+            try:
+                with get_session() as s:
+                    s.execute(
+                        update(SchedulerState)
+                        .where(SchedulerState.id == STATE_ID, SchedulerState.leader_id == self.node_id)
+                        .values(lease_expires=None, running=False)
+                    )
+                    s.commit()
+            except Exception:
+                pass
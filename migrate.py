@@ -1,11 +1,34 @@
 # 数据库迁移原本存储在 WebPage 表中的图片信息迁移到独立的 WebImage 表中
-from db import engine, Base
+from db import engine, upgrade_schema
 from models import WebPage, WebImage
 
 print("开始创建/更新数据库表结构...")
-Base.metadata.create_all(bind=engine)
+upgrade_schema()
 print("数据库表结构创建完成！")
 
+# create_all 不会给已存在的表补建索引，这里逐个检查创建
+print("开始创建/更新索引...")
+for table in (WebPage.__table__, WebImage.__table__):
+    for idx in table.indexes:
+        idx.create(bind=engine, checkfirst=True)
+        print(f"  索引已就绪: {idx.name}")
+with engine.begin() as conn:
+    conn.exec_driver_sql("ANALYZE")  # 更新统计信息，便于 SQLite 选择索引
+
+# 各可写分片同步补列和索引（只读/下线分片跳过）
+from shards import list_shards, shard_engine as get_shard_engine
+from db import add_missing_columns
+for shard in list_shards()[1:]:
+    if shard.state != "active":
+        continue
+    shard_engine = get_shard_engine(shard)
+    add_missing_columns(shard_engine)
+    for table in (WebPage.__table__, WebImage.__table__):
+        for idx in table.indexes:
+            idx.create(bind=shard_engine, checkfirst=True)
+    print(f"  分片已更新: {shard.name}")
+print("索引创建完成！")
+
 
 from db import get_session
 
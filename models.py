@@ -1,18 +1,24 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, LargeBinary, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, LargeBinary, ForeignKey, Index, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 
 Base = declarative_base()
 
 class WebPage(Base):
     __tablename__ = 'webpages'
+    __table_args__ = (
+        Index('ix_webpages_url_timestamp', 'url', 'timestamp'),
+        Index('ix_webpages_timestamp', 'timestamp'),
+        {'sqlite_autoincrement': True},  # 分片按 id 区间划分，见 shards.py
+    )
     id = Column(Integer, primary_key=True)
-    url = Column(String(2048), nullable=False, index=True)
+    url = Column(String(2048), nullable=False)
     ip = Column(String(45))
     timestamp = Column(DateTime, server_default=func.now())
-    html = Column(Text)
-    text = Column(Text)
+    # 大字段延迟加载，只有显式访问时才读取
+    html = deferred(Column(Text))
+    text = deferred(Column(Text))
     sha256 = Column(String(64), index=True)
     
     # 关联多张图片
@@ -21,11 +27,113 @@ class WebPage(Base):
 class WebImage(Base):
 
     __tablename__ = 'webimages'
+    __table_args__ = (
+        Index('ix_webimages_page_order', 'page_id', 'order_index'),
+        Index('ix_webimages_phash', 'phash'),
+        {'sqlite_autoincrement': True},
+    )
     id = Column(Integer, primary_key=True)
     page_id = Column(Integer, ForeignKey('webpages.id'), nullable=False)
     image_url = Column(String(2048), nullable=False)
     phash = Column(String(16))  # 16位十六进制phash
-    thumb_data = Column(LargeBinary)  # 缩略图
+    sha256 = Column(String(64))  # 原始图片内容哈希
+    thumb_data = deferred(Column(LargeBinary))  # 缩略图
     order_index = Column(Integer, default=0)  # 图片在页面中的顺序
     
-    page = relationship("WebPage", back_populates="images")
\ No newline at end of file
+    page = relationship("WebPage", back_populates="images")
+
+class SeenUrl(Base):
+    # 已抓取URL的精确记录，作为布隆过滤器的兜底校验
+    __tablename__ = 'seen_urls'
+    url = Column(String(2048), primary_key=True)  # 规范化后的URL
+    last_fetched = Column(DateTime, nullable=False)
+    fetch_count = Column(Integer, default=1)
+
+class EvidenceBatch(Base):
+    # 一批采集记录的 Merkle 根及签名清单
+    __tablename__ = 'evidence_batches'
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False)
+    root = Column(String(64), nullable=False)
+    leaf_count = Column(Integer, nullable=False)
+    manifest = Column(Text, nullable=False)  # 规范化 JSON
+    signature = Column(String(128), nullable=False)  # Ed25519(manifest) 签名 hex
+
+class EvidenceLeaf(Base):
+    # 单条采集记录（网页或图片）在 Merkle 树中的叶子及包含证明
+    __tablename__ = 'evidence_leaves'
+    __table_args__ = (
+        Index('ux_evidence_leaves_ref', 'kind', 'ref_id', unique=True),
+        Index('ix_evidence_leaves_batch', 'batch_id', 'leaf_index'),
+    )
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(Integer, ForeignKey('evidence_batches.id'), nullable=False)
+    leaf_index = Column(Integer, nullable=False)
+    kind = Column(String(8), nullable=False)  # page / image
+    ref_id = Column(Integer, nullable=False)
+    leaf_hash = Column(String(64), nullable=False)
+    proof = Column(Text, nullable=False)  # JSON: [[L/R, hash], ...]
+
+class SchedulerState(Base):
+    # 调度器共享状态（单行）：期望状态由任意进程写入，leader 持有租约并回写运行状态
+    __tablename__ = 'scheduler_state'
+    id = Column(Integer, primary_key=True)
+    desired_running = Column(Boolean, nullable=False, default=False)
+    generation = Column(Integer, nullable=False, default=0)  # 每次启动请求 +1，leader 据此重建任务
+    leader_id = Column(String(128))
+    lease_expires = Column(DateTime)
+    running = Column(Boolean, nullable=False, default=False)
+    next_run = Column(DateTime)
+    last_run = Column(DateTime)
+
+class Shard(Base):
+    # 按时间划分的采集分片目录；id 同时决定分片内记录的 id 区间（id << SHARD_ID_BITS）
+    __tablename__ = 'shards'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(32), nullable=False, unique=True)  # 如 2026_10
+    path = Column(String(1024), nullable=False)
+    period_start = Column(DateTime, nullable=False)
+    period_end = Column(DateTime, nullable=False)
+    state = Column(String(16), nullable=False, default='active')  # active / readonly / offline
+    created_at = Column(DateTime, server_default=func.now())
+
+class WatchTerm(Base):
+    # 监控清单：关键字或目标图片 phash，新采集的网页/图片入库时即时匹配
+    __tablename__ = 'watch_terms'
+    __table_args__ = (
+        Index('ux_watch_terms_kind_value', 'kind', 'value', unique=True),
+        {'sqlite_autoincrement': True},  # 删除后 id 不复用，告警中的 term_id 不会指向别的条目
+    )
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(8), nullable=False)  # keyword / image
+    value = Column(String(256), nullable=False)  # 关键字原文或 16 位十六进制 phash
+    label = Column(String(256))  # 备注，如案件名称
+    created_at = Column(DateTime, server_default=func.now())
+
+class WatchState(Base):
+    # 监控清单版本（单行）：增删条目时 +1，各进程据此判断是否需要重新编译清单
+    __tablename__ = 'watch_state'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class WatchAlert(Base):
+    # 监控命中记录；page_id/image_id 为全局 id，可直接定位分片
+    __tablename__ = 'watch_alerts'
+    __table_args__ = (
+        Index('ix_watch_alerts_created', 'created_at'),
+        Index('ix_watch_alerts_ack', 'acknowledged', 'id'),
+    )
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False)
+    term_id = Column(Integer, nullable=False)
+    kind = Column(String(8), nullable=False)
+    term = Column(String(256), nullable=False)  # 命中时的关键字/phash，清单删除后仍可查看
+    label = Column(String(256))
+    page_id = Column(Integer, nullable=False)
+    image_id = Column(Integer)
+    url = Column(String(2048), nullable=False)
+    image_url = Column(String(2048))
+    hits = Column(Integer)  # 关键字在正文中出现的次数
+    distance = Column(Integer)  # 图片的汉明距离
+    snippet = Column(Text)  # 关键字上下文
+    acknowledged = Column(Boolean, nullable=False, default=False)
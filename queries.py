@@ -0,0 +1,141 @@
+# queries.py
+# 只读查询层：只选取需要的列并显式 join，避免 ORM 懒加载造成的 N+1 查询和大字段读取；
+# 采集数据按时间分片存放，查询先按时间范围裁剪分片，再并行扇出（见 shards.py）
+from sqlalchemy import select
+from models import WebPage, WebImage
+from shards import select_shards, shard_for_id, shard_session, fan_out, group_ids_by_shard
+
+# SQLite 单条语句绑定参数数量有限，IN 查询分批
+IN_CHUNK = 500
+
+PAGE_COLUMNS = (WebPage.id, WebPage.url, WebPage.ip, WebPage.timestamp, WebPage.sha256)
+
+
+def chunked(items, size=IN_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _time_filter(stmt, start, end):
+    if start is not None:
+        stmt = stmt.where(WebPage.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(WebPage.timestamp < end)
+    return stmt
+
+
+def search_pages_by_text(keyword: str, limit: int = 100, start=None, end=None):
+    # 只返回元数据列，不读取 html；各分片各取前 limit 条再合并
+    stmt = _time_filter(
+        select(*PAGE_COLUMNS)
+        .where(WebPage.text.contains(keyword))
+        .order_by(WebPage.timestamp.desc())
+        .limit(limit),
+        start, end,
+    )
+
+    def run(shard):
+        with shard_session(shard) as s:
+            return s.execute(stmt).mappings().all()
+
+    rows = [row for part in fan_out(run, select_shards(start, end)) for row in part]
+    rows.sort(key=lambda r: r["timestamp"], reverse=True)
+    return rows[:limit]
+
+
+def match_image_hashes(match, start=None, end=None, batch_size: int = 2000) -> dict:
+    # 各分片并行扫描 (id, phash)，match(phash) 返回非 None 的记录收集为 {id: 结果}
+    # 不限时间时由 ix_webimages_phash 覆盖，扫描时不触及图片行本身
+    stmt = select(WebImage.id, WebImage.phash).where(WebImage.phash.is_not(None), WebImage.phash != "")
+    if start is not None or end is not None:
+        stmt = _time_filter(stmt.join(WebPage, WebImage.page_id == WebPage.id), start, end)
+    stmt = stmt.execution_options(yield_per=batch_size)
+
+    def run(shard):
+        found = {}
+        with shard_session(shard) as s:
+            for row in s.execute(stmt):
+                result = match(row.phash)
+                if result is not None:
+                    found[row.id] = result
+        return found
+
+    matches = {}
+    for part in fan_out(run, select_shards(start, end)):
+        matches.update(part)
+    return matches
+
+
+def get_images_with_pages(image_ids):
+    # 按分片分组，一次 join 取回命中图片及其所属页面信息（不含缩略图）
+    def run(item):
+        shard, ids = item
+        rows = []
+        with shard_session(shard) as s:
+            for chunk in chunked(ids):
+                stmt = (
+                    select(
+                        WebImage.id.label("image_id"),
+                        WebImage.image_url,
+                        WebImage.phash,
+                        WebImage.order_index,
+                        WebPage.url,
+                        WebPage.ip,
+                        WebPage.timestamp,
+                        WebPage.sha256,
+                    )
+                    .join(WebPage, WebImage.page_id == WebPage.id)
+                    .where(WebImage.id.in_(chunk))
+                )
+                rows.extend(s.execute(stmt).mappings().all())
+        return rows
+
+    return [row for part in fan_out(run, list(group_ids_by_shard(image_ids).items())) for row in part]
+
+
+def get_thumbs(image_ids) -> dict:
+    # 缩略图只为最终返回的结果读取
+    def run(item):
+        shard, ids = item
+        thumbs = {}
+        with shard_session(shard) as s:
+            for chunk in chunked(ids):
+                stmt = select(WebImage.id, WebImage.thumb_data).where(WebImage.id.in_(chunk))
+                for row in s.execute(stmt):
+                    thumbs[row.id] = row.thumb_data
+        return thumbs
+
+    thumbs = {}
+    for part in fan_out(run, list(group_ids_by_shard(image_ids).items())):
+        thumbs.update(part)
+    return thumbs
+
+
+def get_latest_page(url: str):
+    # 从最新分片开始找，命中即停；走 ix_webpages_url_timestamp 的 url 前缀
+    stmt = (
+        select(*PAGE_COLUMNS)
+        .where(WebPage.url == url)
+        .order_by(WebPage.id.desc())
+        .limit(1)
+    )
+    for shard in select_shards():
+        with shard_session(shard) as s:
+            row = s.execute(stmt).mappings().first()
+        if row is not None:
+            return row
+    return None
+
+
+def get_page_images(page_id: int):
+    # 走 ix_webimages_page_order，按页面内顺序返回
+    shard = shard_for_id(page_id)
+    if shard is None:
+        return []
+    stmt = (
+        select(WebImage.id, WebImage.image_url, WebImage.phash, WebImage.thumb_data)
+        .where(WebImage.page_id == page_id)
+        .order_by(WebImage.order_index)
+    )
+    with shard_session(shard) as s:
+        return s.execute(stmt).mappings().all()
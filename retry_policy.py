@@ -0,0 +1,250 @@
+# retry_policy.py
+# 抓取失败分类与延迟重试：
+#   permanent  - 4xx（408/429 除外）、无效 URL、证书错误等，不重试
+#   throttle   - 429/503，按 Retry-After 推迟该主机的请求
+#   transient  - 超时、连接重置、408、其他 5xx，放入延迟重试队列（抖动指数退避）
+# 每个主机一个熔断器：连续失败达到阈值后在冷却期内直接跳过，不再发起请求；
+# 冷却后的试探请求仍失败，说明主机已不可用，丢弃该主机所有排队中的重试
+import time
+import heapq
+import random
+import datetime
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+
+PERMANENT = "permanent"
+THROTTLE = "throttle"
+TRANSIENT = "transient"
+CIRCUIT_OPEN = "circuit_open"
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 5
+DEFAULT_MAX_DELAY = 300
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 60
+DEFAULT_DRAIN_TIMEOUT = 600  # 任务结束前最多等待延迟重试的秒数
+
+
+class FetchError(Exception):
+
+    def __init__(self, url: str, kind: str, message: str, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.url = url
+        self.kind = kind
+        self.status = status
+        self.retry_after = retry_after  # 秒；throttle / circuit_open 时有效
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind != PERMANENT
+
+
+def url_host(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+def parse_retry_after(value) -> float:
+    # Retry-After 可以是秒数或 HTTP 日期
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+def classify_status(status: int) -> str:
+    if status in (429, 503):
+        return THROTTLE
+    if status == 408 or status >= 500:
+        return TRANSIENT
+    return PERMANENT
+
+def classify_exception(e: Exception) -> str:
+    # SSLError 是 ConnectionError 的子类，但证书问题重试也不会恢复
+    if isinstance(e, requests.exceptions.SSLError):
+        return PERMANENT
+    if isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                      requests.exceptions.ChunkedEncodingError)):
+        return TRANSIENT
+    return PERMANENT
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.tripped = False
+
+    def check(self, now: float) -> float:
+        # 返回需要等待的秒数，0 表示可以请求（冷却结束后放行一次试探请求）
+        return max(0.0, self.open_until - now)
+
+    def success(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.tripped = False
+
+    def failure(self, now: float) -> bool:
+        # 返回本次失败是否使熔断器打开；冷却后的试探请求失败则立即重新熔断
+        self.failures += 1
+        if self.tripped or self.failures >= self.threshold:
+            self.open_until = max(self.open_until, now + self.cooldown)
+            self.failures = 0
+            self.tripped = True
+            return True
+        return False
+
+    def block(self, now: float, seconds: float):
+        # 限流：在 Retry-After 之前不再请求该主机
+        self.open_until = max(self.open_until, now + seconds)
+
+
+class RunStats:
+    # 单次抓取任务的请求与失败统计
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"ok": 0, PERMANENT: 0, THROTTLE: 0, TRANSIENT: 0, CIRCUIT_OPEN: 0,
+                       "deferred": 0, "retried_ok": 0, "gave_up": 0, "breaker_opened": 0}
+        self.status_codes = {}
+        self.host_failures = {}
+
+    def incr(self, name: str, n: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def failure(self, host: str, error: FetchError):
+        with self.lock:
+            self.counts[error.kind] += 1
+            if error.status is not None:
+                self.status_codes[error.status] = self.status_codes.get(error.status, 0) + 1
+            if error.kind != CIRCUIT_OPEN:
+                self.host_failures[host] = self.host_failures.get(host, 0) + 1
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                **self.counts,
+                "status_codes": {str(k): v for k, v in sorted(self.status_codes.items())},
+                "host_failures": dict(sorted(self.host_failures.items(), key=lambda kv: -kv[1])[:20]),
+            }
+
+
+class RetryPolicy:
+
+    def __init__(self, config: dict = None):
+        crawler_cfg = (config or {}).get("crawler", {}) or {}
+        self.max_attempts = int(crawler_cfg.get("retry_times", DEFAULT_MAX_ATTEMPTS))
+        self.base_delay = float(crawler_cfg.get("retry_delay", DEFAULT_BASE_DELAY))
+        self.max_delay = float(crawler_cfg.get("retry_max_delay", DEFAULT_MAX_DELAY))
+        self.breaker_threshold = int(crawler_cfg.get("breaker_threshold", DEFAULT_BREAKER_THRESHOLD))
+        self.breaker_cooldown = float(crawler_cfg.get("breaker_cooldown", DEFAULT_BREAKER_COOLDOWN))
+        self.drain_timeout = float(crawler_cfg.get("drain_timeout", DEFAULT_DRAIN_TIMEOUT))
+        self.breakers = {}
+        self.queue = []  # (到期时间, 序号, 已尝试次数, 主机, 任务)
+        self.seq = itertools.count()
+        self.stats = RunStats()
+
+    def _breaker(self, host: str) -> CircuitBreaker:
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+        return self.breakers[host]
+
+    def before_request(self, url: str, host: str):
+        # 熔断或限流中的主机直接抛出 circuit_open，由调用方推迟
+        wait = self._breaker(host).check(time.monotonic())
+        if wait > 0:
+            error = FetchError(url, CIRCUIT_OPEN, f"{host} 熔断/限流中，{wait:.0f} 秒后重试", retry_after=wait)
+            self.stats.failure(host, error)
+            raise error
+
+    def record_success(self, host: str):
+        self._breaker(host).success()
+        self.stats.incr("ok")
+
+    def record_failure(self, host: str, error: FetchError):
+        now = time.monotonic()
+        self.stats.failure(host, error)
+        breaker = self._breaker(host)
+        probing = breaker.tripped  # 冷却结束后的试探请求
+        if error.kind == THROTTLE:
+            # Retry-After 由服务器决定，最多按 retry_max_delay 暂停该主机
+            wait = error.retry_after if error.retry_after is not None else self.base_delay
+            breaker.block(now, min(wait, self.max_delay))
+        if error.kind in (THROTTLE, TRANSIENT) and breaker.failure(now):
+            self.stats.incr("breaker_opened")
+            print(f"[RETRY] {host} 连续失败，熔断 {self.breaker_cooldown:.0f} 秒")
+            if probing and error.kind == TRANSIENT:
+                self.drop_host(host)
+
+    def drop_host(self, host: str) -> int:
+        # 主机再次熔断：排队中的重试也会失败，全部放弃，不再等待冷却
+        kept = [item for item in self.queue if item[3] != host]
+        dropped = len(self.queue) - len(kept)
+        if dropped:
+            self.queue = kept
+            heapq.heapify(self.queue)
+            self.stats.incr("gave_up", dropped)
+            print(f"[RETRY] {host} 试探请求失败，放弃 {dropped} 个排队中的重试")
+        return dropped
+
+    def backoff(self, attempt: int) -> float:
+        # 指数退避加抖动，避免大量重试同时到期
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.5)
+
+    def defer(self, task, error: FetchError, attempts: int = 1) -> bool:
+        # attempts 为已尝试次数；可重试的失败放入延迟队列，返回 False 表示不再重试
+        # 熔断跳过同样计入尝试次数，否则不可用主机上的任务会一直排队
+        if not error.retryable:
+            return False
+        if attempts >= self.max_attempts:
+            self.stats.incr("gave_up")
+            print(f"[RETRY] 放弃: {error.url[:80]} ({error})")
+            return False
+        if error.kind == THROTTLE and (error.retry_after or 0) > self.max_delay:
+            # 要求等待的时间超过 retry_max_delay：不排队，否则结束时 drain 会一直阻塞
+            self.stats.incr("gave_up")
+            print(f"[RETRY] 放弃: {error.url[:80]} (Retry-After {error.retry_after:.0f} 秒超过 {self.max_delay:.0f} 秒)")
+            return False
+        delay = min(self.max_delay, max(self.backoff(attempts - 1), error.retry_after or 0))
+        heapq.heappush(self.queue, (time.monotonic() + delay, next(self.seq), attempts, url_host(error.url), task))
+        self.stats.incr("deferred")
+        return True
+
+    def pop_due(self, wait: bool = False, deadline: float = None):
+        # 取出一个到期任务 (已尝试次数, 任务)；wait 为 True 时等待最早的任务到期，
+        # 但不会等到 deadline（time.monotonic()）之后；队列空或超过 deadline 时返回 None
+        if not self.queue:
+            return None
+        due = self.queue[0][0]
+        now = time.monotonic()
+        if due > now:
+            if not wait or (deadline is not None and due > deadline):
+                return None
+            time.sleep(due - now)
+        _, _, attempt, _, task = heapq.heappop(self.queue)
+        return attempt, task
+
+    def abandon(self) -> int:
+        # 结束时仍未执行的重试全部放弃
+        dropped = len(self.queue)
+        if dropped:
+            self.queue = []
+            self.stats.incr("gave_up", dropped)
+            print(f"[RETRY] 等待超时，放弃 {dropped} 个延迟重试任务")
+        return dropped
+
+    def __len__(self):
+        return len(self.queue)
@@ -0,0 +1,227 @@
+# search_cache.py
+# 搜索结果缓存：有界 LRU，存放在 data_dir 下的独立 SQLite 文件中，多个 Web 进程共享；
+# 爬虫每提交一批新的 WebPage/WebImage 就把抓取代数 +1，旧代数的缓存自动失效。
+# 缓存出错（文件被锁、不可写等）时只记录日志，搜索照常查库；
+# 代数更新失败时写入 .stale 标记文件，所有进程停用缓存，直到下一次代数更新成功
+import os
+import json
+import time
+import threading
+from sqlalchemy import create_engine, text
+from config import load_config
+
+DEFAULT_MAX_ENTRIES = 256
+FLUSH_INTERVAL = 10  # 秒；命中计数和访问时间在进程内累积，定期批量写回
+
+
+def normalize_keyword(kw: str) -> str:
+    # SQLite LIKE 只对 ASCII 忽略大小写，这里只折叠 ASCII，保证缓存命中与查询结果一致
+    return "".join(c.lower() if c.isascii() else c for c in kw.strip())
+
+def _range_suffix(start, end) -> str:
+    if start is None and end is None:
+        return ""
+    return f"@{start.isoformat() if start else ''}~{end.isoformat() if end else ''}"
+
+def text_key(kw: str, start=None, end=None) -> str:
+    return f"text:{normalize_keyword(kw)}{_range_suffix(start, end)}"
+
+def image_key(phash: str, threshold: int, start=None, end=None) -> str:
+    return f"img:{phash}:{threshold}{_range_suffix(start, end)}"
+
+
+class SearchCache:
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.stale_path = path + ".stale"
+        self.max_entries = max_entries
+        self.engine = create_engine(f"sqlite:///{path}", future=True,
+                                    connect_args={"timeout": 2})  # 缓存写入很短，被锁太久就放弃，不拖慢搜索
+        self.ready = False
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.touched = {}  # key -> 最近访问时间
+        self.last_flush = time.monotonic()
+
+    def _ensure_schema(self):
+        # 首次使用时建表；失败后下次调用会重试
+        if self.ready:
+            return
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key         TEXT PRIMARY KEY,
+                generation  INTEGER NOT NULL,
+                value       TEXT NOT NULL,
+                last_access REAL NOT NULL
+            );
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_cache_last_access ON cache_entries(last_access)"))
+            conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                name  TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """))
+            conn.execute(text(
+                "INSERT OR IGNORE INTO cache_meta(name, value) VALUES "
+                "('generation', 0), ('hits', 0), ('misses', 0)"
+            ))
+        self.ready = True
+
+    def _meta(self, conn, name: str) -> int:
+        return conn.execute(text("SELECT value FROM cache_meta WHERE name=:n"), {"n": name}).scalar() or 0
+
+    def stale(self) -> bool:
+        return os.path.exists(self.stale_path)
+
+    def generation(self) -> int:
+        # 读取失败或缓存已停用时返回 None，调用方据此不写入缓存
+        if self.stale():
+            return None
+        try:
+            self._ensure_schema()
+            with self.engine.connect() as conn:
+                return self._meta(conn, "generation")
+        except Exception as e:
+            print(f"[CACHE] 读取代数失败: {e}")
+            return None
+
+    def bump_generation(self) -> bool:
+        # 只在新采集数据或分片状态变化后调用；失败时停用缓存，不能让旧结果继续返回
+        try:
+            self._ensure_schema()
+            with self.engine.begin() as conn:
+                conn.execute(text("UPDATE cache_meta SET value = value + 1 WHERE name='generation'"))
+        except Exception as e:
+            print(f"[CACHE] 更新代数失败，搜索缓存暂停使用: {e}")
+            try:
+                open(self.stale_path, "a").close()
+            except OSError as e2:
+                print(f"[CACHE] 无法写入停用标记: {e2}")
+            return False
+        if self.stale():
+            # 新代数已使此前的缓存全部失效，可以恢复使用
+            try:
+                os.remove(self.stale_path)
+                print("[CACHE] 搜索缓存恢复使用")
+            except FileNotFoundError:
+                pass
+        return True
+
+    def get(self, key: str):
+        # 只读查询，不占用写锁；出错或缓存已停用时按未命中处理
+        if self.stale():
+            return None
+        try:
+            self._ensure_schema()
+            with self.engine.connect() as conn:
+                row = conn.execute(text(
+                    "SELECT e.value FROM cache_entries e, cache_meta m "
+                    "WHERE e.key=:k AND m.name='generation' AND e.generation = m.value"
+                ), {"k": key}).first()
+        except Exception as e:
+            print(f"[CACHE] 读取缓存失败，直接查询: {e}")
+            return None
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.touched[key] = time.time()
+        if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+        return json.loads(row[0]) if row else None
+
+    def _flush(self, conn):
+        # 把进程内累积的计数和访问时间写回；调用方负责事务
+        with self.lock:
+            hits, misses, touched = self.hits, self.misses, self.touched
+            self.hits, self.misses, self.touched = 0, 0, {}
+            self.last_flush = time.monotonic()
+        try:
+            if hits:
+                conn.execute(text("UPDATE cache_meta SET value = value + :n WHERE name='hits'"), {"n": hits})
+            if misses:
+                conn.execute(text("UPDATE cache_meta SET value = value + :n WHERE name='misses'"), {"n": misses})
+            if touched:
+                conn.execute(text("UPDATE cache_entries SET last_access=:t WHERE key=:k AND last_access < :t"),
+                             [{"t": t, "k": k} for k, t in touched.items()])
+        except Exception:
+            with self.lock:
+                # 写回失败时放回，下次再写
+                self.hits += hits
+                self.misses += misses
+                for k, t in touched.items():
+                    self.touched[k] = max(t, self.touched.get(k, 0))
+            raise
+
+    def flush(self):
+        try:
+            with self.engine.begin() as conn:
+                self._flush(conn)
+        except Exception as e:
+            print(f"[CACHE] 写回统计失败: {e}")
+
+    def put(self, key: str, value, generation: int):
+        # generation 为查询开始前读取的代数；查询期间有新数据提交则不写入，避免缓存旧结果
+        if generation is None:
+            return
+        try:
+            self._put(key, value, generation)
+        except Exception as e:
+            print(f"[CACHE] 写入缓存失败: {e}")
+
+    def _put(self, key: str, value, generation: int):
+        with self.engine.begin() as conn:
+            if generation != self._meta(conn, "generation"):
+                return
+            self._flush(conn)  # 先写回访问时间，LRU 淘汰才准确
+            conn.execute(text(
+                "INSERT OR REPLACE INTO cache_entries(key, generation, value, last_access) "
+                "VALUES (:k, :g, :v, :t)"
+            ), {"k": key, "g": generation, "v": json.dumps(value, ensure_ascii=False), "t": time.time()})
+            # 先清理失效代数，再按 LRU 淘汰超出上限的条目
+            conn.execute(text("DELETE FROM cache_entries WHERE generation != :g"), {"g": generation})
+            conn.execute(text(
+                "DELETE FROM cache_entries WHERE key IN ("
+                "SELECT key FROM cache_entries ORDER BY last_access DESC LIMIT -1 OFFSET :n)"
+            ), {"n": self.max_entries})
+
+    def stats(self) -> dict:
+        self.flush()
+        with self.engine.connect() as conn:
+            hits = self._meta(conn, "hits")
+            misses = self._meta(conn, "misses")
+            entries = conn.execute(text("SELECT COUNT(*) FROM cache_entries")).scalar()
+            generation = self._meta(conn, "generation")
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "generation": generation,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache(config: dict = None) -> SearchCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if config is None:
+                config = load_config()
+            data_dir = config.get("data_dir", "./data")
+            os.makedirs(data_dir, exist_ok=True)
+            cache_cfg = config.get("search_cache", {}) or {}
+            _cache = SearchCache(os.path.join(data_dir, "search_cache.db"),
+                                 cache_cfg.get("max_entries", DEFAULT_MAX_ENTRIES))
+        return _cache
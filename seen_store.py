@@ -0,0 +1,194 @@
+# seen_store.py
+# 跨运行持久化的已访问URL集合：布隆过滤器做快速否定判断，seen_urls 表做精确兜底
+# 多个抓取进程共用同一个过滤器文件：写回前在文件锁内先并入磁盘上的位，
+# 启动时和运行中定期从 seen_urls 表合并其他进程（或崩溃前未写回）的记录
+import os
+import math
+import time
+import hashlib
+import datetime
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from models import SeenUrl
+from db import get_session
+from urlnorm import normalize_url
+
+DEFAULT_SYNC_SECONDS = 60
+SYNC_SLACK = datetime.timedelta(seconds=60)  # 未提交的事务、各进程时钟偏差
+
+
+@contextmanager
+def file_lock(path: str):
+    # 跨进程互斥锁
+    with open(path, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        # m = -n*ln(p)/(ln2)^2, k = m/n*ln2
+        self.num_bits = int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        # 双重哈希：一次 blake2b 派生 k 个位置
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.bits)
+        os.replace(tmp_path, path)  # 原子替换，避免写一半被读到
+
+    def merge_file(self, path: str) -> bool:
+        # 把磁盘上的位并入内存（按位或）；文件不存在或大小与当前参数不一致（容量改过）时返回 False
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+        if len(data) != len(self.bits):
+            return False
+        merged = int.from_bytes(self.bits, "little") | int.from_bytes(data, "little")
+        self.bits = bytearray(merged.to_bytes(len(self.bits), "little"))
+        return True
+
+
+class SeenStore:
+
+    def __init__(self, data_dir: str = "./data", capacity: int = 1_000_000, error_rate: float = 0.001,
+                 sync_seconds: float = DEFAULT_SYNC_SECONDS):
+        os.makedirs(data_dir, exist_ok=True)
+        self.path = os.path.join(data_dir, "seen_urls.bloom")
+        self.lock_path = self.path + ".lock"
+        self.bloom = BloomFilter(capacity, error_rate)
+        # 重抓间隔（分钟）：默认值 + 按URL单独配置
+        self.default_interval = 0
+        self.intervals = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.sync_seconds = sync_seconds
+        self.synced_at = 0.0   # time.monotonic()
+        self.synced_since = None  # 上次同步开始时的 utcnow，下次只合并此后写入的记录
+        # 磁盘文件可能缺少崩溃前未写回的 URL，启动时总是用精确表全量合并一次
+        with self.lock:
+            with file_lock(self.lock_path):
+                self.bloom.merge_file(self.path)
+            self.sync(full=True)
+            self.flush_locked()
+
+    def sync(self, full: bool = False):
+        # 调用方持有 self.lock；从精确表合并其他进程写入的 URL
+        started = datetime.datetime.utcnow()
+        with get_session() as s:
+            query = s.query(SeenUrl.url)
+            if not full and self.synced_since is not None:
+                query = query.filter(SeenUrl.last_fetched >= self.synced_since - SYNC_SLACK)
+            added = 0
+            for (url,) in query.yield_per(1000):
+                self.bloom.add(url)
+                added += 1
+        self.synced_since = started
+        self.synced_at = time.monotonic()
+        if added:
+            self.dirty = True
+
+    def maybe_sync(self):
+        with self.lock:
+            if time.monotonic() - self.synced_at >= self.sync_seconds:
+                self.sync()
+
+    def interval_for(self, url: str) -> float:
+        return self.intervals.get(url, self.default_interval)
+
+    def is_due(self, url: str) -> bool:
+        # url 需已规范化；从未抓过或距上次抓取超过重抓间隔时返回 True
+        self.maybe_sync()
+        with self.lock:
+            if url not in self.bloom:
+                return True  # 布隆过滤器否定：一定没见过，不查库
+        with get_session() as s:
+            row = s.get(SeenUrl, url)
+            if row is None:
+                return True  # 假阳性
+            age = datetime.datetime.utcnow() - row.last_fetched
+            return age >= datetime.timedelta(minutes=self.interval_for(url))
+
+    def mark_seen(self, url: str):
+        now = datetime.datetime.utcnow()
+        with get_session() as s:
+            row = s.get(SeenUrl, url)
+            if row is None:
+                s.add(SeenUrl(url=url, last_fetched=now, fetch_count=1))
+            else:
+                row.last_fetched = now
+                row.fetch_count = (row.fetch_count or 0) + 1
+            s.commit()
+        with self.lock:
+            self.bloom.add(url)
+            self.dirty = True
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self.flush_locked()
+
+    def flush_locked(self):
+        # 其他进程可能已写回自己的 URL：文件锁内先并入磁盘上的位再整体写回，不覆盖别人的结果
+        with file_lock(self.lock_path):
+            self.bloom.merge_file(self.path)
+            self.bloom.save(self.path)
+        self.dirty = False
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_seen_store(config: dict) -> SeenStore:
+    global _store
+    recrawl = config.get("recrawl", {}) or {}
+    with _store_lock:
+        if _store is None:
+            _store = SeenStore(
+                data_dir=config.get("data_dir", "./data"),
+                capacity=recrawl.get("bloom_capacity", 1_000_000),
+                error_rate=recrawl.get("bloom_error_rate", 0.001),
+                sync_seconds=float(recrawl.get("bloom_sync_seconds", DEFAULT_SYNC_SECONDS)),
+            )
+        # 重抓间隔每次按最新配置刷新，修改配置无需重启
+        _store.default_interval = recrawl.get("default_minutes", 0)
+        _store.intervals = {normalize_url(u): m for u, m in (recrawl.get("urls") or {}).items()}
+        return _store
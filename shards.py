@@ -0,0 +1,326 @@
+# shards.py
+# 按月分片的采集归档：webpages/webimages 写入 data_dir/shards 下每月一个 SQLite 文件，
+# 主库 forensic.db 中的 shards 表作为目录；查询按时间范围裁剪后并行扇出到各分片。
+# 分片 n 中记录的 id 从 n << SHARD_ID_BITS 开始，因此 id 全局唯一且可直接定位分片；
+# 主库本身视为 0 号分片（开启分片前的历史数据）。
+#   python shards.py list
+#   python shards.py readonly 2026_01      设为只读
+#   python shards.py compact 2026_01       VACUUM 压缩
+#   python shards.py move 2026_01 /cold    迁移到冷存储（仍可查询）
+#   python shards.py offline 2026_01       下线，查询时跳过
+#   python shards.py online 2026_01       重新上线（只读）
+import os
+import sys
+import time
+import shutil
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from models import Base, WebPage, WebImage, Shard
+from db import engine as main_engine, get_session, add_missing_columns, DB_FILE
+from search_cache import get_search_cache
+from config import load_config
+
+SHARD_ID_BITS = 40
+CAPTURE_TABLES = [WebPage.__table__, WebImage.__table__]
+FAN_OUT_WORKERS = 8
+CHECKPOINT_RETRIES = 10
+
+
+class ShardInfo:
+
+    def __init__(self, index, name, path, period_start, period_end, state):
+        self.index = index
+        self.name = name
+        self.path = path
+        self.period_start = period_start  # None 表示不限
+        self.period_end = period_end
+        self.state = state
+
+    @property
+    def id_min(self):
+        return self.index << SHARD_ID_BITS
+
+    @property
+    def id_max(self):
+        return ((self.index + 1) << SHARD_ID_BITS) - 1
+
+    def overlaps(self, start, end) -> bool:
+        if start is not None and self.period_end is not None and self.period_end <= start:
+            return False
+        if end is not None and self.period_start is not None and self.period_start >= end:
+            return False
+        return True
+
+MAIN_SHARD = ShardInfo(0, "main", DB_FILE, None, None, "active")
+
+USAGE = """用法:
+  python shards.py list
+  python shards.py readonly|offline|online <名称>
+  python shards.py compact <名称>
+  python shards.py move <名称> <目标目录>"""
+
+def sharding_enabled(config: dict = None) -> bool:
+    config = config if config is not None else load_config()
+    return bool((config.get("sharding", {}) or {}).get("enabled", False))
+
+def shard_dir(config: dict) -> str:
+    sharding = config.get("sharding", {}) or {}
+    return sharding.get("dir") or os.path.join(config.get("data_dir", "./data"), "shards")
+
+def month_period(ts: datetime.datetime):
+    start = datetime.datetime(ts.year, ts.month, 1)
+    end = datetime.datetime(ts.year + (ts.month == 12), ts.month % 12 + 1, 1)
+    return f"{ts:%Y_%m}", start, end
+
+
+# ---------- 引擎 ----------
+
+_engines = {}
+_sessions = {}
+_initialized = set()
+_engines_lock = threading.Lock()
+_executor = None
+_main_shard = None
+
+
+def shard_engine(shard: ShardInfo):
+    if shard.index == 0:
+        return main_engine
+    key = (shard.index, shard.path, shard.state)
+    with _engines_lock:
+        if key not in _engines:
+            if shard.state == "readonly":
+                # 只读分片以 mode=ro 打开，防止误写
+                url = f"sqlite:///file:{os.path.abspath(shard.path)}?mode=ro&uri=true"
+            else:
+                url = f"sqlite:///{shard.path}"
+            _engines[key] = create_engine(url, echo=False, future=True)
+            _sessions[key] = sessionmaker(bind=_engines[key], expire_on_commit=False)
+        return _engines[key]
+
+def shard_session(shard: ShardInfo):
+    if shard.index == 0:
+        return get_session()
+    shard_engine(shard)
+    return _sessions[(shard.index, shard.path, shard.state)]()
+
+
+# ---------- 目录 ----------
+
+def _get_main_shard() -> ShardInfo:
+    # 开启分片后主库不再写入采集数据，其时间范围固定，缓存后用于裁剪
+    global _main_shard
+    if not sharding_enabled():
+        return MAIN_SHARD
+    if _main_shard is None:
+        with get_session() as s:
+            lo, hi = s.execute(select(func.min(WebPage.timestamp), func.max(WebPage.timestamp))).one()
+        if lo is None:
+            lo = hi = datetime.datetime.min
+        _main_shard = ShardInfo(0, "main", DB_FILE, lo, hi + datetime.timedelta(microseconds=1), "readonly")
+    return _main_shard
+
+def list_shards(include_offline: bool = False) -> list:
+    # 每次从主库读取，其他进程新建的分片能立即被看到
+    shards = [_get_main_shard()]
+    with get_session() as s:
+        for row in s.scalars(select(Shard).order_by(Shard.id)):
+            if row.state == "offline" and not include_offline:
+                continue
+            shards.append(ShardInfo(row.id, row.name, row.path, row.period_start, row.period_end, row.state))
+    return shards
+
+def shard_for_id(record_id: int, shards: list = None) -> ShardInfo:
+    index = record_id >> SHARD_ID_BITS
+    for shard in shards if shards is not None else list_shards(include_offline=True):
+        if shard.index == index:
+            return shard
+    return None
+
+def select_shards(start=None, end=None) -> list:
+    # 时间范围裁剪：只返回与 [start, end) 有交集的分片，新分片在前
+    return [sh for sh in reversed(list_shards()) if sh.overlaps(start, end)]
+
+def _init_shard_file(shard: ShardInfo):
+    if (shard.index, shard.path) in _initialized:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(shard.path)), exist_ok=True)
+    target = shard_engine(shard)
+    Base.metadata.create_all(bind=target, tables=CAPTURE_TABLES)
+    add_missing_columns(target)
+    with target.begin() as conn:
+        # 设置自增起点，使本分片 id 落在自己的区间内
+        for table in ("webpages", "webimages"):
+            seq = conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).scalar()
+            if seq is None:
+                conn.exec_driver_sql("INSERT INTO sqlite_sequence(name, seq) VALUES (?, ?)", (table, shard.id_min))
+    _initialized.add((shard.index, shard.path))
+
+def shard_for_write(ts: datetime.datetime, config: dict = None) -> ShardInfo:
+    # 写入路由：未开启分片时写主库，否则写 ts 所在月份的分片（不存在则创建）
+    config = config if config is not None else load_config()
+    if not sharding_enabled(config):
+        return MAIN_SHARD
+    name, start, end = month_period(ts)
+    with get_session() as s:
+        row = s.scalar(select(Shard).where(Shard.name == name))
+        if row is None:
+            path = os.path.join(shard_dir(config), f"captures_{name}.db")
+            try:
+                row = Shard(name=name, path=path, period_start=start, period_end=end, state="active")
+                s.add(row)
+                s.commit()
+                print(f"[SHARD] 新建分片 {name}: {path}")
+            except IntegrityError:
+                # 其他进程刚创建了同名分片
+                s.rollback()
+                row = s.scalar(select(Shard).where(Shard.name == name))
+        shard = ShardInfo(row.id, row.name, row.path, row.period_start, row.period_end, row.state)
+    if shard.state != "active":
+        raise RuntimeError(f"分片 {name} 当前状态为 {shard.state}，不能写入")
+    _init_shard_file(shard)
+    return shard
+
+
+# ---------- 扇出查询 ----------
+
+def fan_out(fn, shards: list) -> list:
+    # 对每个分片并行执行 fn(shard)，按传入顺序返回结果
+    global _executor
+    if len(shards) <= 1:
+        return [fn(sh) for sh in shards]
+    with _engines_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS)
+    return list(_executor.map(fn, shards))
+
+def group_ids_by_shard(ids) -> dict:
+    shards = list_shards(include_offline=True)
+    groups = {}
+    for record_id in ids:
+        shard = shard_for_id(record_id, shards)
+        if shard is not None and shard.state != "offline":
+            groups.setdefault(shard, []).append(record_id)
+    return groups
+
+
+# ---------- 维护 ----------
+
+def _get_row(s, name: str) -> Shard:
+    row = s.scalar(select(Shard).where(Shard.name == name))
+    if row is None:
+        raise ValueError(f"分片不存在: {name}")
+    return row
+
+def _current_name() -> str:
+    return month_period(datetime.datetime.utcnow())[0]
+
+def _checkpoint(path: str):
+    # 把 WAL 合并进主文件。保持 WAL 模式：切换日志模式需要独占文件，
+    # 而每个做过搜索的进程都保留着到各分片的空闲连接；各进程看到状态变化后按只读重新打开
+    file_engine = create_engine(f"sqlite:///{path}", future=True)
+    try:
+        with file_engine.connect() as conn:
+            for _ in range(CHECKPOINT_RETRIES):
+                busy, _, _ = conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").one()
+                if not busy:
+                    return
+                time.sleep(0.5)  # 有进程正在读写，稍后重试
+    finally:
+        file_engine.dispose()
+    raise RuntimeError(f"分片 {os.path.basename(path)} 正在被写入，WAL 合并失败，请稍后重试")
+
+def _to_delete_journal(path: str):
+    # 迁移后的副本还没有进程打开，可以切回 DELETE 日志模式，放在只读介质上也不需要 -wal/-shm 文件
+    file_engine = create_engine(f"sqlite:///{path}", future=True)
+    try:
+        with file_engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=DELETE")
+    finally:
+        file_engine.dispose()
+
+def _invalidate_search_cache():
+    # 分片上下线、迁移后可查询的数据变了，缓存的搜索结果全部作废
+    try:
+        get_search_cache(load_config()).bump_generation()
+    except Exception as e:
+        print(f"[SHARD] 搜索缓存失效失败，旧结果可能仍被返回: {e}")
+
+def set_state(name: str, state: str):
+    if state != "active" and name == _current_name():
+        raise ValueError("当前月份的分片仍在写入，不能设为只读或下线")
+    with get_session() as s:
+        row = _get_row(s, name)
+        if state != "active" and os.path.exists(row.path):
+            _checkpoint(row.path)
+        row.state = state
+        s.commit()
+        print(f"[SHARD] {name} -> {state}")
+    _invalidate_search_cache()
+
+def compact(name: str):
+    with get_session() as s:
+        row = _get_row(s, name)
+        if row.state == "active":
+            raise ValueError("请先将分片设为只读")
+        path = row.path
+    size_before = os.path.getsize(path)
+    file_engine = create_engine(f"sqlite:///{path}", future=True)
+    with file_engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    file_engine.dispose()
+    print(f"[SHARD] {name} 压缩完成: {size_before} -> {os.path.getsize(path)} 字节")
+
+def move(name: str, dest_dir: str):
+    # 只读分片才能迁移；先复制再更新目录，最后删除旧文件
+    with get_session() as s:
+        row = _get_row(s, name)
+        if row.state == "active":
+            raise ValueError("请先将分片设为只读")
+        src = row.path
+        os.makedirs(dest_dir, exist_ok=True)
+        dst = os.path.join(dest_dir, os.path.basename(src))
+        _checkpoint(src)
+        shutil.copy2(src, dst)
+        _to_delete_journal(dst)
+        row.path = dst
+        s.commit()
+    _invalidate_search_cache()
+    os.remove(src)
+    print(f"[SHARD] {name} 已迁移: {src} -> {dst}")
+
+def print_shards():
+    print(f"{'名称':<10}{'状态':<10}{'时间范围':<25}{'网页':>8}{'图片':>8}  路径")
+    for shard in list_shards(include_offline=True):
+        if shard.state == "offline" or not (shard.index == 0 or os.path.exists(shard.path)):
+            pages = images = "-"
+        else:
+            with shard_session(shard) as s:
+                pages = s.scalar(select(func.count(WebPage.id)))
+                images = s.scalar(select(func.count(WebImage.id)))
+        period = "-" if shard.period_start is None else \
+            f"{shard.period_start:%Y-%m-%d}~{shard.period_end:%Y-%m-%d}"
+        print(f"{shard.name:<10}{shard.state:<10}{period:<25}{pages:>8}{images:>8}  {shard.path}")
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] == "list":
+        print_shards()
+    elif args[0] in ("readonly", "offline", "online") and len(args) == 2:
+        set_state(args[1], {"readonly": "readonly", "offline": "offline", "online": "readonly"}[args[0]])
+    elif args[0] == "compact" and len(args) == 2:
+        compact(args[1])
+    elif args[0] == "move" and len(args) == 3:
+        move(args[1], args[2])
+    else:
+        print(USAGE)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    from db import upgrade_schema
+    upgrade_schema()
+    main()
@@ -0,0 +1,51 @@
+# urlnorm.py
+# URL规范化：app 与 crawler 共用，保证同一资源只对应一个URL
+from urllib.parse import urlparse, urlunparse, unquote_plus
+
+# 不影响页面内容的跟踪参数
+TRACKING_PARAMS = {
+    "gclid", "fbclid", "msclkid", "yclid", "dclid", "igshid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "spm", "from_spm",
+}
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def normalize_url(url: str) -> str:
+    try:
+        parsed = urlparse(url.strip())
+        # 统一小写协议与主机名
+        scheme = parsed.scheme.lower()
+        host = (parsed.hostname or "").rstrip(".")
+        if ":" in host:
+            host = f"[{host}]"  # IPv6
+
+        # 去掉默认端口
+        netloc = host
+        port = parsed.port
+        if port is not None and DEFAULT_PORTS.get(scheme) != port:
+            netloc = f"{host}:{port}"
+        if parsed.username:
+            userinfo = parsed.username
+            if parsed.password:
+                userinfo += f":{parsed.password}"
+            netloc = f"{userinfo}@{netloc}"
+
+        path = parsed.path or "/"
+
+        # 去掉跟踪参数，剩余参数排序，避免顺序不同被当成不同URL
+        # 按原样保留各参数，不重新编码，无值参数 k 与 k= 不合并
+        query = [p for p in parsed.query.split("&")
+                 if p and not _is_tracking_param(unquote_plus(p.split("=", 1)[0]))]
+        query.sort()
+
+        # 丢弃片段(#...)
+        return urlunparse((scheme, netloc, path, parsed.params, "&".join(query), ""))
+    except Exception:
+        return url
@@ -0,0 +1,234 @@
+# watchlist.py
+# 入库时监控：关键字清单编译成 Aho-Corasick 自动机，目标图片 phash 放入内存索引，
+# fetch_and_save 每保存一个网页就对其正文和图片各匹配一次，命中写入 watch_alerts。
+# 监控开销只与新采集的数据量有关，与历史数据量和监控条目数无关
+import re
+import string
+import datetime
+import threading
+from collections import deque
+from sqlalchemy import select, func, update
+from sqlalchemy.exc import IntegrityError
+from models import WatchTerm, WatchAlert, WatchState
+from db import get_session
+from batch_search import HashIndex
+
+SNIPPET_CHARS = 40
+STATE_ID = 1
+PHASH_RE = re.compile(r"^[0-9a-f]{16}$")
+_ASCII_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def fold(s: str) -> str:
+    # 与 SQLite LIKE 一致，只折叠 ASCII 大小写；不改变长度，命中位置可直接用于原文
+    return s.translate(_ASCII_FOLD)
+
+
+class AhoCorasick:
+    # 多模式串匹配自动机：一次扫描文本即可找出所有关键字，耗时与文本长度成正比
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = nxt
+            self.output[node].append(index)
+
+        # 按层构建失败指针，并把失败链上的输出合并到当前节点
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def search(self, text: str):
+        # 依次产出 (模式序号, 结束位置)
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for index in self.output[node]:
+                yield index, pos
+
+
+class Watchlist:
+
+    def __init__(self, terms, threshold: int):
+        # terms: [(id, kind, value, label)]
+        self.keywords = [t for t in terms if t[1] == "keyword"]
+        self.automaton = AhoCorasick([fold(t[2]) for t in self.keywords]) if self.keywords else None
+        self.targets = {}
+        for t in terms:
+            if t[1] == "image":
+                self.targets.setdefault(t[2], []).append(t)
+        self.index = HashIndex(self.targets, threshold) if self.targets else None
+
+    @property
+    def empty(self) -> bool:
+        return self.automaton is None and self.index is None
+
+    def match_text(self, text: str) -> list:
+        # 返回 [(条目, 出现次数, 首次出现处的上下文)]
+        if self.automaton is None or not text:
+            return []
+        found = {}
+        for index, end in self.automaton.search(fold(text)):
+            if index in found:
+                found[index][0] += 1
+            else:
+                found[index] = [1, end]
+        results = []
+        for index, (hits, end) in found.items():
+            term = self.keywords[index]
+            begin = end + 1 - len(term[2])
+            snippet = text[max(0, begin - SNIPPET_CHARS):end + 1 + SNIPPET_CHARS]
+            results.append((term, hits, snippet))
+        return results
+
+    def match_phash(self, phash: str) -> list:
+        # 返回 [(条目, 汉明距离)]
+        if self.index is None or not phash:
+            return []
+        found = self.index.match(phash) or {}
+        return [(term, distance) for target, distance in found.items() for term in self.targets[target]]
+
+
+# ---------- 清单缓存 ----------
+
+_watchlist = None
+_signature = None
+_lock = threading.Lock()
+
+
+def get_watchlist(config: dict) -> Watchlist:
+    # 清单很少变化：按 (清单版本, 阈值) 判断是否需要重新编译，其他进程修改后也能感知
+    global _watchlist, _signature
+    threshold = int(config.get("hamming_threshold", 5))
+    with get_session() as s:
+        signature = (s.scalar(select(WatchState.version).where(WatchState.id == STATE_ID)) or 0, threshold)
+        with _lock:
+            if _watchlist is None or signature != _signature:
+                terms = s.execute(select(WatchTerm.id, WatchTerm.kind, WatchTerm.value, WatchTerm.label)).all()
+                _watchlist = Watchlist([tuple(t) for t in terms], threshold)
+                _signature = signature
+                print(f"[WATCH] 监控清单已加载: 关键字 {len(_watchlist.keywords)}，目标图片 {len(_watchlist.targets)}")
+            return _watchlist
+
+
+def check_capture(config: dict, page_id: int, url: str, text: str, images) -> int:
+    # images: [(image_id, image_url, phash)]；由 fetch_and_save 在网页提交后调用
+    watchlist = get_watchlist(config)
+    if watchlist.empty:
+        return 0
+    now = datetime.datetime.utcnow()
+    alerts = []
+    for (term_id, kind, value, label), hits, snippet in watchlist.match_text(text):
+        alerts.append(WatchAlert(created_at=now, term_id=term_id, kind=kind, term=value, label=label,
+                                 page_id=page_id, url=url, hits=hits, snippet=snippet))
+    for image_id, image_url, phash in images:
+        for (term_id, kind, value, label), distance in watchlist.match_phash(phash):
+            alerts.append(WatchAlert(created_at=now, term_id=term_id, kind=kind, term=value, label=label,
+                                     page_id=page_id, image_id=image_id, url=url, image_url=image_url,
+                                     distance=distance))
+    if alerts:
+        with get_session() as s:
+            s.add_all(alerts)
+            s.commit()
+        print(f"[WATCH] {url} 命中 {len(alerts)} 条监控")
+    return len(alerts)
+
+
+# ---------- 管理 ----------
+
+def _ensure_state(s):
+    if s.get(WatchState, STATE_ID) is None:
+        try:
+            s.add(WatchState(id=STATE_ID, version=0))
+            s.commit()
+        except IntegrityError:
+            s.rollback()
+
+def _bump_version(s):
+    # 与增删条目在同一事务内提交
+    s.execute(update(WatchState).where(WatchState.id == STATE_ID).values(version=WatchState.version + 1))
+
+def list_terms() -> list:
+    with get_session() as s:
+        rows = s.scalars(select(WatchTerm).order_by(WatchTerm.id.desc())).all()
+    return [{"id": t.id, "kind": t.kind, "value": t.value, "label": t.label,
+             "created_at": t.created_at.strftime('%Y-%m-%d %H:%M:%S') if t.created_at else None}
+            for t in rows]
+
+def add_terms(kind: str, values, label: str = None) -> int:
+    # 返回新增条数，已存在的条目跳过
+    if kind not in ("keyword", "image"):
+        raise ValueError(f"未知监控类型: {kind}")
+    added = 0
+    with get_session() as s:
+        _ensure_state(s)
+        for value in values:
+            value = value.strip()
+            if not value:
+                continue
+            if kind == "image":
+                value = value.lower()
+                if not PHASH_RE.match(value):
+                    raise ValueError(f"phash 应为 16 位十六进制: {value}")
+            else:
+                value = fold(value)  # 匹配时忽略 ASCII 大小写，入库前统一，避免重复条目
+            try:
+                s.add(WatchTerm(kind=kind, value=value, label=label or None))
+                _bump_version(s)
+                s.commit()
+                added += 1
+            except IntegrityError:
+                s.rollback()
+    return added
+
+def delete_term(term_id: int) -> bool:
+    with get_session() as s:
+        _ensure_state(s)
+        term = s.get(WatchTerm, term_id)
+        if term is None:
+            return False
+        s.delete(term)
+        _bump_version(s)
+        s.commit()
+    return True
+
+def list_alerts(limit: int = 100, unread_only: bool = False) -> list:
+    stmt = select(WatchAlert).order_by(WatchAlert.id.desc()).limit(limit)
+    if unread_only:
+        stmt = stmt.where(WatchAlert.acknowledged.is_(False))
+    with get_session() as s:
+        return s.scalars(stmt).all()
+
+def count_unread() -> int:
+    with get_session() as s:
+        return s.scalar(select(func.count(WatchAlert.id)).where(WatchAlert.acknowledged.is_(False)))
+
+def ack_alerts(ids=None) -> int:
+    # ids 为空时全部标记已读
+    stmt = update(WatchAlert).where(WatchAlert.acknowledged.is_(False)).values(acknowledged=True)
+    if ids:
+        stmt = stmt.where(WatchAlert.id.in_(ids))
+    with get_session() as s:
+        result = s.execute(stmt)
+        s.commit()
+    return result.rowcount
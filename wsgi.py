@@ -0,0 +1,9 @@
+# wsgi.py
+# 生产部署入口（多进程）：
+#   gunicorn -c gunicorn.conf.py wsgi:application
+# 表结构与配置文件由 gunicorn.conf.py 在主进程中初始化一次；
+# 每个 worker 进程各自参与调度器选主，只有 leader 进程运行定时任务
+from app import app, start_leader_election
+
+start_leader_election()
+application = app